@@ -0,0 +1,19 @@
+import json
+import zlib
+from pathlib import Path
+from config.settings import MANAGERS_CONFIG
+
+
+def load_managers_config(path: Path = MANAGERS_CONFIG) -> list[dict]:
+    """Прочитать список менеджеров из managers/config.json (пустой список, если файла нет)"""
+    path = Path(path)
+    if not path.exists():
+        return []
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def shard_of(manager_id: str, shard_count: int) -> int:
+    """Номер шарда менеджера (стабильный между запусками, в отличие от hash())"""
+    return zlib.crc32(manager_id.encode('utf-8')) % shard_count
@@ -0,0 +1,187 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм (секунды): от миллисекунды до десятков секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Текстовый формат экспозиции Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    """Метки в формате Prometheus: {name="value",...}"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        """Увеличить счетчик"""
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge:
+    """Текущее значение с метками; значения можно снимать колбэком в момент запроса"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 callback: Optional[Callable[[], dict]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, *labels):
+        """Установить значение"""
+        self._values[labels] = value
+
+    def render(self) -> list[str]:
+        values = self.callback() if self.callback else self._values
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами (кумулятивные bucket'ы Prometheus)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # метки -> [счетчики bucket'ов..., сумма, количество]
+
+    def observe(self, value: float, *labels):
+        """Учесть наблюдение"""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """Замерить время выполнения блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их вывод в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = (),
+              callback: Optional[Callable[[], dict]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.render()
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        # Повторная регистрация (например, колбэка после перезапуска) заменяет метрику
+        self._metrics[metric.name] = metric
+        return metric
+
+
+# Общий реестр метрик процесса
+registry = MetricsRegistry()
+
+# Горячий путь приема событий
+events_total = registry.counter(
+    'telegram_events_total', 'Обработанные события Telegram', ('manager_id', 'direction')
+)
+handler_seconds = registry.histogram(
+    'telegram_handler_seconds', 'Время обработки события анализатором', ('handler', 'manager_id')
+)
+
+# Запросы к Supabase (метка - имя запроса, которое передает вызывающий код в execute)
+db_request_seconds = registry.histogram(
+    'supabase_request_seconds', 'Время запроса к Supabase (включая ожидание пула потоков)', ('function',)
+)
+db_errors_total = registry.counter(
+    'supabase_errors_total', 'Ошибки запросов к Supabase', ('function',)
+)
+
+# Отзывчивость event loop
+event_loop_lag_seconds = registry.histogram(
+    'event_loop_lag_seconds', 'Задержка пробуждения event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
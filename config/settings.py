@@ -11,29 +11,90 @@ DATA_DIR = BASE_DIR / "managers" / "sessions"
 LOG_DIR = BASE_DIR / "logs"
 BACKUP_DIR = BASE_DIR / "backups"
 
-# Создаем папки если не существуют
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-LOG_DIR.mkdir(parents=True, exist_ok=True)
-BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+# Менеджеры
+MANAGERS_CONFIG = Path(os.getenv("MANAGERS_CONFIG", BASE_DIR / "managers" / "config.json"))
+CONFIG_RELOAD_INTERVAL = int(os.getenv("CONFIG_RELOAD_INTERVAL", 10))  # Проверка изменений файла
+
+# Шардирование: SHARD_COUNT процессов, у каждого свой поднабор менеджеров
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", 0))  # Выставляет супервизор для процесса шарда
+SHARD_STATUS_INTERVAL = int(os.getenv("SHARD_STATUS_INTERVAL", 60))
+SHARD_STABLE_AFTER = int(os.getenv("SHARD_STABLE_AFTER", 300))  # После этого счетчик перезапусков сбрасывается
+
+# Запуск: одновременно подключаемых сессий Telegram
+STARTUP_CONCURRENCY = int(os.getenv("STARTUP_CONCURRENCY", 10))
 
 # Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Максимум одновременных запросов к Supabase (размер пула потоков)
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", 8))
 
 # Система
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 STATS_UPDATE_INTERVAL = int(os.getenv("STATS_UPDATE_INTERVAL", 300))
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", 3600))
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", 60))
 BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", 21600))
 NEW_CLIENT_HOURS = int(os.getenv("NEW_CLIENT_HOURS", 24))
 
+# Ожидание ответа менеджера (дольше TTL - не считаем время ответа)
+RESPONSE_PENDING_TTL_HOURS = int(os.getenv("RESPONSE_PENDING_TTL_HOURS", 24))
+RESPONSE_PENDING_MAX = int(os.getenv("RESPONSE_PENDING_MAX", 10000))
+
+# Снимок индекса клиентов: пишется при остановке, при старте заменяет чтение окна NEW_CLIENT_HOURS из БД
+CLIENT_INDEX_DIR = Path(os.getenv("CLIENT_INDEX_DIR", BACKUP_DIR / "client_index"))
+
+# Фильтр повторов событий (последние N сообщений процесса по (менеджер, чат, ID сообщения))
+RECENT_MESSAGES_MAX = int(os.getenv("RECENT_MESSAGES_MAX", 100000))
+
+# Кэш источников клиентов (максимум записей в LRU)
+CHANNEL_CACHE_SIZE = int(os.getenv("CHANNEL_CACHE_SIZE", 100000))
+
+# Справочник каналов для атрибуции (период перечитывания, секунд)
+ATTRIBUTION_REFRESH_INTERVAL = int(os.getenv("ATTRIBUTION_REFRESH_INTERVAL", 600))
+
+# Статус userbot'ов: окно активных чатов и редкое обновление списка диалогов
+ACTIVE_CHAT_WINDOW = int(os.getenv("ACTIVE_CHAT_WINDOW", 86400))
+DIALOGS_REFRESH_INTERVAL = int(os.getenv("DIALOGS_REFRESH_INTERVAL", 21600))
+
+# HTTP-эндпоинт метрик Prometheus (у шарда - порт METRICS_PORT + номер шарда)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+METRICS_LAG_INTERVAL = float(os.getenv("METRICS_LAG_INTERVAL", 0.5))  # период замера задержки event loop
+
+# Лимиты запросов к Telegram на аккаунт (token bucket)
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", 1.0))  # запросов в секунду
+TELEGRAM_BURST = int(os.getenv("TELEGRAM_BURST", 5))
+TELEGRAM_FLOOD_RETRIES = int(os.getenv("TELEGRAM_FLOOD_RETRIES", 2))
+
+# Догрузка истории (одновременных диалогов на аккаунт)
+BACKFILL_DIALOG_CONCURRENCY = int(os.getenv("BACKFILL_DIALOG_CONCURRENCY", 3))
+
+# Пакетная запись переписок
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", 500))
+BATCH_FLUSH_INTERVAL = float(os.getenv("BATCH_FLUSH_INTERVAL", 1.0))
+BATCH_MAX_BACKOFF = float(os.getenv("BATCH_MAX_BACKOFF", 60.0))
+
+# Локальный журнал переписок (переживает недоступность Supabase и рестарты)
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() == "true"
+# У каждого шарда свой журнал (SQLite - один писатель на файл)
+_SPOOL_NAME = f"conversations_{SHARD_INDEX}.db" if SHARD_COUNT > 1 else "conversations.db"
+SPOOL_PATH = Path(os.getenv("SPOOL_PATH", BACKUP_DIR / "spool" / _SPOOL_NAME))
+
+# Локальное аналитическое зеркало (Parquet по дням + DuckDB, нужен пакет duckdb)
+LOCAL_STORE_ENABLED = os.getenv("LOCAL_STORE_ENABLED", "false").lower() == "true"
+LOCAL_STORE_DIR = Path(os.getenv("LOCAL_STORE_DIR", BACKUP_DIR / "analytics"))
+LOCAL_STORE_FLUSH_ROWS = int(os.getenv("LOCAL_STORE_FLUSH_ROWS", 50000))
+LOCAL_STORE_FLUSH_INTERVAL = float(os.getenv("LOCAL_STORE_FLUSH_INTERVAL", 300))
+
 # Уведомления
 ADMIN_TELEGRAM_ID = os.getenv("ADMIN_TELEGRAM_ID")
 ENABLE_NOTIFICATIONS = os.getenv("ENABLE_NOTIFICATIONS", "true").lower() == "true"
 
-# Проверка обязательных настроек
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL и SUPABASE_KEY обязательны в .env файле")
 
-print(f"✅ Настройки загружены")
-print(f"📁 DATA_DIR: {DATA_DIR}")
-print(f"📊 LOG_DIR: {LOG_DIR}")
+def ensure_dirs():
+    """Создать рабочие папки (вызывают точки входа, импорт настроек ничего не создает)"""
+    for directory in (DATA_DIR, LOG_DIR, BACKUP_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
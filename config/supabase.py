@@ -1,64 +1,188 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
-from config.settings import SUPABASE_URL, SUPABASE_KEY
+from config.settings import SUPABASE_URL, SUPABASE_KEY, SUPABASE_MAX_CONCURRENCY
+from config.metrics import db_request_seconds, db_errors_total
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Создаем клиента Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Клиент Supabase создается при первом запросе, а не при импорте модуля
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+
+def get_client() -> Client:
+    """Клиент Supabase (создается при первом обращении)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not SUPABASE_URL or not SUPABASE_KEY:
+                    raise ValueError("SUPABASE_URL и SUPABASE_KEY обязательны в .env файле")
+                _client = create_client(SUPABASE_URL, SUPABASE_KEY)
+                logger.info("✅ Supabase клиент инициализирован")
+    return _client
+
+# Клиент синхронный: запросы выполняются в ограниченном пуле потоков,
+# чтобы не блокировать event loop (и вместе с ним все TelegramClient'ы)
+_executor = ThreadPoolExecutor(
+    max_workers=SUPABASE_MAX_CONCURRENCY,
+    thread_name_prefix="supabase"
+)
+
+async def execute(query, label: str):
+    """Выполнить запрос PostgREST в пуле потоков, не блокируя event loop (label - метка в метриках)"""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, query.execute)
+    except Exception:
+        db_errors_total.inc(label)
+        raise
+    finally:
+        db_request_seconds.observe(time.perf_counter() - started, label)
+
+def parse_time(value: str) -> datetime:
+    """Разобрать timestamp из БД в naive datetime (как пишет datetime.now())"""
+    return datetime.fromisoformat(value).replace(tzinfo=None)
 
 async def test_connection():
     """Проверка подключения к Supabase"""
     try:
-        result = supabase.table('telegram_conversations').select("count", count='exact').limit(1).execute()
+        result = await execute(
+            get_client().table('telegram_conversations').select("count", count='exact').limit(1),
+            'test_connection'
+        )
         logger.info(f"✅ Supabase подключен успешно")
         return True
     except Exception as e:
         logger.error(f"❌ Ошибка подключения к Supabase: {e}")
         return False
 
-async def save_conversation(data: dict):
-    """Сохранить данные о переписке"""
-    try:
-        result = supabase.table('telegram_conversations').insert(data).execute()
-        return result.data
-    except Exception as e:
-        logger.error(f"Ошибка сохранения переписки: {e}")
-        return None
+def _message_key(row: dict) -> tuple:
+    return row['manager_id'], row.get('chat_id'), row.get('telegram_message_id')
+
+async def save_conversations(rows: list) -> list:
+    """Сохранить пачку переписок одним запросом. Возвращает записанные строки (без уже бывших в БД)"""
+    # Повторы внутри пачки отбрасываем сразу (строки без ID сообщения - всегда уникальны)
+    unique = {}
+    for i, row in enumerate(rows):
+        key = _message_key(row) if row.get('telegram_message_id') is not None else i
+        unique.setdefault(key, row)
+    rows = list(unique.values())
+    if not rows:
+        return []
+
+    result = await execute(
+        get_client().table('telegram_conversations').upsert(
+            rows, on_conflict='manager_id,chat_id,telegram_message_id', ignore_duplicates=True
+        ),
+        'save_conversations'
+    )
+    # ON CONFLICT DO NOTHING возвращает только вставленные строки
+    inserted = {_message_key(row) for row in result.data}
+    return [
+        row for row in rows
+        if row.get('telegram_message_id') is None or _message_key(row) in inserted
+    ]
 
 async def save_daily_stats(data: dict):
     """Сохранить дневную статистику"""
-    try:
-        # Проверяем, есть ли уже запись за этот день для этого менеджера
-        existing = supabase.table('telegram_daily_stats').select('*').eq(
-            'manager_id', data['manager_id']
-        ).eq('date', data['date']).execute()
-
-        if existing.data:
-            # Обновляем существующую запись
-            result = supabase.table('telegram_daily_stats').update(data).eq(
-                'id', existing.data[0]['id']
-            ).execute()
-        else:
-            # Создаем новую запись
-            result = supabase.table('telegram_daily_stats').insert(data).execute()
+    return await upsert_daily_stats([data])
 
+async def upsert_daily_stats(rows: list):
+    """Сохранить дневную статистику пачкой (upsert по manager_id, date)"""
+    if not rows:
+        return []
+    try:
+        result = await execute(
+            get_client().table('telegram_daily_stats').upsert(rows, on_conflict='manager_id,date'),
+            'upsert_daily_stats'
+        )
         return result.data
     except Exception as e:
         logger.error(f"Ошибка сохранения статистики: {e}")
         return None
 
-async def get_client_history(client_telegram_id: int, manager_id: str):
-    """Получить историю переписок с клиентом"""
-    try:
-        result = supabase.table('telegram_conversations').select('*').eq(
-            'client_telegram_id', client_telegram_id
-        ).eq('manager_id', manager_id).order('message_time', desc=True).execute()
+async def get_closed_daily_stats(manager_ids: list, start_date, end_date):
+    """Получить закрытые (посчитанные окончательно) дни статистики"""
+    result = await execute(
+        get_client().table('telegram_daily_stats').select('*').in_(
+            'manager_id', manager_ids
+        ).gte('date', start_date.isoformat()).lte('date', end_date.isoformat()).eq('is_closed', True),
+        'get_closed_daily_stats'
+    )
+
+    return result.data
+
+async def reopen_daily_stats(manager_id: str, dates: list):
+    """Снять отметку закрытого дня (пришли поздние сообщения - день нужно пересчитать)"""
+    result = await execute(
+        get_client().table('telegram_daily_stats').update({'is_closed': False}).eq(
+            'manager_id', manager_id
+        ).in_('date', [d.isoformat() for d in dates]),
+        'reopen_daily_stats'
+    )
 
+    return result.data
+
+async def save_manager_metrics(data: dict):
+    """Сохранить метрики менеджера за период (upsert по менеджеру и периоду)"""
+    try:
+        result = await execute(
+            get_client().table('telegram_manager_metrics').upsert(
+                data, on_conflict='manager_id,period_start,period_end'
+            ),
+            'save_manager_metrics'
+        )
         return result.data
     except Exception as e:
-        logger.error(f"Ошибка получения истории: {e}")
-        return []
+        logger.error(f"Ошибка сохранения метрик менеджера: {e}")
+        return None
+
+async def merge_hourly_rollup(rows: list, batch_id: str) -> bool:
+    """Прибавить приращения часовой свертки. False - пачка batch_id уже была применена"""
+    if not rows:
+        return True
+    result = await execute(
+        get_client().rpc('merge_hourly_rollup', {'rows': rows, 'batch_id': batch_id}),
+        'merge_hourly_rollup'
+    )
+    return bool(result.data)
+
+async def replace_hourly_rollup(rows: list, since: datetime, until: datetime):
+    """Заменить свертку за часы [since, until) пересчитанными строками"""
+    await execute(get_client().rpc('replace_hourly_rollup', {
+        'rows': rows, 'since': since.isoformat(), 'until': until.isoformat()
+    }), 'replace_hourly_rollup')
+
+async def get_client_channel_source(client_telegram_id: int, manager_id: str):
+    """Получить канал, с которого пришел клиент (атрибуция первого контакта)"""
+    result = await execute(
+        get_client().table('telegram_conversations').select('channel_source').eq(
+            'client_telegram_id', client_telegram_id
+        ).eq('manager_id', manager_id).not_.is_('channel_source', 'null').neq(
+            'channel_source', 'unknown'
+        ).order('message_time').limit(1),
+        'get_client_channel_source'
+    )
+
+    return result.data[0]['channel_source'] if result.data else None
+
+async def get_channel_sources():
+    """Получить справочник известных каналов для атрибуции"""
+    result = await execute(
+        get_client().table('telegram_channel_sources').select(
+            'channel_name,channel_username,start_param,channel_telegram_id'
+        ),
+        'get_channel_sources'
+    )
+
+    return result.data or []
 
 async def is_new_client(client_telegram_id: int, manager_id: str, hours: int = 24):
     """Проверить, новый ли это клиент (не писал более N часов)"""
@@ -67,15 +191,59 @@ async def is_new_client(client_telegram_id: int, manager_id: str, hours: int = 2
 
         cutoff_time = datetime.now() - timedelta(hours=hours)
 
-        result = supabase.table('telegram_conversations').select('*').eq(
-            'client_telegram_id', client_telegram_id
-        ).eq('manager_id', manager_id).gte(
-            'message_time', cutoff_time.isoformat()
-        ).execute()
+        result = await execute(
+            get_client().table('telegram_conversations').select('id').eq(
+                'client_telegram_id', client_telegram_id
+            ).eq('manager_id', manager_id).gte(
+                'message_time', cutoff_time.isoformat()
+            ).limit(1),
+            'is_new_client'
+        )
 
         return len(result.data) == 0
     except Exception as e:
         logger.error(f"Ошибка проверки клиента: {e}")
         return True  # По умолчанию считаем новым
 
-logger.info("✅ Supabase клиент инициализирован")
+async def stream_rows(table: str, columns: str, apply_filters=None, page_size: int = 1000,
+                      time_column: str = 'message_time', label: str = 'stream_rows'):
+    """Потоково выбрать строки: keyset-пагинация по (time_column, id), только нужные колонки"""
+    fields = [c.strip() for c in columns.split(',')]
+    for key in ('id', time_column):
+        if key not in fields:
+            fields.append(key)
+    select = ', '.join(fields)
+
+    cursor = None
+    while True:
+        query = get_client().table(table).select(select)
+        if apply_filters is not None:
+            query = apply_filters(query)
+        if cursor is not None:
+            last_time, last_id = cursor
+            query = query.or_(
+                f'{time_column}.gt."{last_time}",and({time_column}.eq."{last_time}",id.gt.{last_id})'
+            )
+        # Составной порядок одной строкой: order=<time_column>,id
+        result = await execute(query.order(f'{time_column},id').limit(page_size), label)
+
+        for row in result.data:
+            yield row
+
+        if len(result.data) < page_size:
+            return
+        last = result.data[-1]
+        cursor = (last[time_column], last['id'])
+
+async def get_recent_activity(since: datetime, manager_ids: list[str]):
+    """Получить (менеджер, клиент, время, тип, ID сообщения) сообщений менеджеров начиная с since"""
+    if not manager_ids:
+        return []
+    return [
+        row async for row in stream_rows(
+            'telegram_conversations',
+            'manager_id, client_telegram_id, message_time, message_type, chat_id, telegram_message_id',
+            lambda q: q.in_('manager_id', manager_ids).gte('message_time', since.isoformat()),
+            label='get_recent_activity'
+        )
+    ]
@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+from config.settings import ACTIVE_CHAT_WINDOW
+
+
+class ActivityTracker:
+    """Счетчики активности userbot'а, которые ведут обработчики событий (без запросов к Telegram)"""
+
+    def __init__(self, window: float = ACTIVE_CHAT_WINDOW):
+        self.window = window
+        # chat_id -> время последнего сообщения; порядок = порядок активности
+        self._chats: OrderedDict[int, float] = OrderedDict()
+        # Времена событий за последнюю минуту
+        self._events: deque[float] = deque()
+        self.last_activity: Optional[float] = None
+        self.total_events = 0
+
+    def record(self, chat_id: int, now: float = None):
+        """Учесть сообщение в чате"""
+        now = time.monotonic() if now is None else now
+        self._chats[chat_id] = now
+        self._chats.move_to_end(chat_id)
+        self._events.append(now)
+        self.last_activity = now
+        self.total_events += 1
+
+        self._prune(now)
+
+    def active_chats(self) -> int:
+        """Количество чатов с сообщениями в скользящем окне"""
+        self._prune(time.monotonic())
+        return len(self._chats)
+
+    def events_per_minute(self) -> int:
+        """Количество событий за последнюю минуту"""
+        self._prune(time.monotonic())
+        return len(self._events)
+
+    def _prune(self, now: float):
+        chat_cutoff = now - self.window
+        while self._chats:
+            chat_id, seen = next(iter(self._chats.items()))
+            if seen >= chat_cutoff:
+                break
+            del self._chats[chat_id]
+
+        event_cutoff = now - 60
+        while self._events and self._events[0] < event_cutoff:
+            self._events.popleft()
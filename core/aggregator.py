@@ -0,0 +1,161 @@
+import logging
+from datetime import datetime, date
+from typing import Optional
+from core.histogram import ResponseTimeHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class DailyStatsBucket:
+    """Счетчики дневной статистики одного менеджера"""
+
+    def __init__(self):
+        self.new_clients: set[int] = set()
+        self.returning_clients: set[int] = set()
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.response_times = ResponseTimeHistogram()
+        # (chat_id, ID сообщения) учтенных строк БД - чтобы при сверке не учесть их дважды
+        self.message_keys: set[tuple[int, int]] = set()
+
+    def add(self, client_id: int, message_type: str, is_new: bool, response_time_minutes: Optional[float]):
+        """Учесть одно сообщение"""
+        # Определяем новых/повторных клиентов
+        if is_new:
+            self.new_clients.add(client_id)
+        else:
+            self.returning_clients.add(client_id)
+
+        # Считаем сообщения
+        if message_type == 'outgoing':
+            self.messages_sent += 1
+
+            # Собираем время ответа
+            if response_time_minutes:
+                self.response_times.add(float(response_time_minutes) * 60)
+        else:
+            self.messages_received += 1
+
+    def add_row(self, conv: dict):
+        """Учесть строку из telegram_conversations"""
+        if conv.get('telegram_message_id') is not None:
+            self.message_keys.add((conv.get('chat_id'), conv['telegram_message_id']))
+        self.add(
+            conv['client_telegram_id'],
+            conv['message_type'],
+            conv.get('is_new_client'),
+            conv.get('response_time_minutes')
+        )
+
+    def to_stats(self, manager_id: str, target_date: date) -> dict:
+        """Строка для telegram_daily_stats"""
+        avg_response_time = None
+        if self.response_times.count:
+            avg_response_time = self.response_times.mean() / 60
+
+        return {
+            'manager_id': manager_id,
+            'date': target_date.isoformat(),
+            'new_clients': len(self.new_clients),
+            'returning_clients': len(self.returning_clients),
+            'total_conversations': len(self.new_clients) + len(self.returning_clients),
+            'messages_sent': self.messages_sent,
+            'messages_received': self.messages_received,
+            'avg_response_time_minutes': round(avg_response_time, 1) if avg_response_time else None,
+            'response_time_histogram': self.response_times.to_dict() if self.response_times.count else None
+        }
+
+
+class DailyStatsAggregator:
+    """Инкрементальная дневная статистика, обновляемая по мере обработки событий"""
+
+    def __init__(self):
+        self._buckets: dict[tuple[str, date], DailyStatsBucket] = {}
+        self._dirty: set[tuple[str, date]] = set()
+        # День старта процесса неполон, пока его не засеяли полным пересчетом
+        self._started_on = date.today()
+        self._seeded: set[tuple[str, date]] = set()
+        # События с последней сверки: (chat_id, ID сообщения) -> аргументы add.
+        # Пока строка не видна в БД (в журнале, в пачке или записана во время пересчета),
+        # сверка добавляет ее к результату пересчета
+        self._unconfirmed: dict[tuple[str, date], dict[tuple[int, int], tuple]] = {}
+
+    def record(self, manager_id: str, message_time: datetime, client_id: int, message_type: str,
+               is_new: bool = False, response_time_minutes: Optional[float] = None,
+               message_key: Optional[tuple[int, int]] = None):
+        """Учесть обработанное сообщение (message_key - (chat_id, ID сообщения) строки в БД)"""
+        key = (manager_id, message_time.date())
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = DailyStatsBucket()
+
+        event = (client_id, message_type, is_new, response_time_minutes)
+        bucket.add(*event)
+        if message_key is not None:
+            self._unconfirmed.setdefault(key, {})[message_key] = event
+        self._dirty.add(key)
+
+    def seed(self, manager_id: str, target_date: date, bucket: DailyStatsBucket):
+        """Заменить счетчики результатом полного пересчета плюс события, которых в нем еще нет"""
+        key = (manager_id, target_date)
+
+        # Пересчет видит только записанное в БД: события из журнала и записанные
+        # за время пересчета добавляем сами, уже учтенные в нем - пропускаем
+        unconfirmed = {
+            message_key: event
+            for message_key, event in self._unconfirmed.pop(key, {}).items()
+            if message_key not in bucket.message_keys
+        }
+        for event in unconfirmed.values():
+            bucket.add(*event)
+        if unconfirmed:
+            self._unconfirmed[key] = unconfirmed
+
+        bucket.message_keys.clear()
+        self._buckets[key] = bucket
+        self._seeded.add(key)
+        self._dirty.discard(key)
+
+    def is_complete(self, manager_id: str, target_date: date) -> bool:
+        """Счетчики охватывают весь день (а не только время после старта)"""
+        return target_date > self._started_on or (manager_id, target_date) in self._seeded
+
+    def snapshot(self, manager_id: str, target_date: date) -> Optional[dict]:
+        """Текущая статистика дня без изменения состояния (None - счетчиков нет или день неполон)"""
+        bucket = self._buckets.get((manager_id, target_date))
+        if bucket is None or not self.is_complete(manager_id, target_date):
+            return None
+        return bucket.to_stats(manager_id, target_date)
+
+    def pop_dirty(self) -> list[dict]:
+        """Забрать изменившиеся полные дни для сохранения"""
+        today = date.today()
+        stats = []
+
+        for key in sorted(self._dirty, key=lambda k: k[1]):
+            manager_id, target_date = key
+            if not self.is_complete(manager_id, target_date):
+                continue
+
+            stats.append(self._buckets[key].to_stats(manager_id, target_date))
+            self._dirty.discard(key)
+
+        # Прошедшие дни больше не меняются - освобождаем память
+        for key in [k for k in self._buckets if k[1] < today]:
+            if key not in self._dirty or not self.is_complete(*key):
+                del self._buckets[key]
+                self._dirty.discard(key)
+                self._seeded.discard(key)
+                self._unconfirmed.pop(key, None)
+
+        return stats
+
+    def mark_dirty(self, manager_id: str, target_date: date):
+        """Вернуть день в очередь на сохранение (например, после ошибки записи)"""
+        key = (manager_id, target_date)
+        if key in self._buckets:
+            self._dirty.add(key)
+
+
+# Общий агрегатор для всех userbot'ов процесса
+daily_stats_aggregator = DailyStatsAggregator()
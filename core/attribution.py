@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import re
+from collections import deque
+from typing import Optional
+from config.supabase import get_channel_sources
+from config.settings import ATTRIBUTION_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Запасной вариант, пока справочник каналов пуст: первое @упоминание
+_MENTION_RE = re.compile(r'@(\w+)')
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+class _Automaton:
+    """Aho-Corasick: все шаблоны ищутся за один линейный проход по тексту"""
+
+    def __init__(self, patterns: dict[str, str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[tuple[int, str]]] = [[]]  # (длина шаблона, источник)
+
+        for pattern, source in patterns.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(pattern), source))
+
+        # Суффиксные ссылки обходом в ширину (у детей корня ссылка на корень)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def search(self, text: str):
+        """Найденные шаблоны: (позиция начала, позиция конца, источник) в порядке конца"""
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, source in self._output[state]:
+                yield end - length, end, source
+
+
+class AttributionEngine:
+    """Определение канала-источника по справочнику telegram_channel_sources"""
+
+    def __init__(self, refresh_interval: float = ATTRIBUTION_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._automaton: Optional[_Automaton] = None
+        self._by_channel_id: dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.sources_count = 0
+
+    def build(self, sources: list[dict]):
+        """Собрать автомат из строк справочника"""
+        patterns = {}
+        by_channel_id = {}
+
+        for row in sources:
+            source = row['channel_name']
+            names = {source, row.get('channel_username')}
+            for name in filter(None, names):
+                name = name.lower().lstrip('@')
+                patterns[f'@{name}'] = source
+                patterns[f't.me/{name}'] = source
+                patterns[f'telegram.me/{name}'] = source
+            if row.get('start_param'):
+                patterns[f"start={row['start_param'].lower()}"] = source
+            if row.get('channel_telegram_id'):
+                by_channel_id[int(row['channel_telegram_id'])] = source
+
+        self._automaton = _Automaton(patterns) if patterns else None
+        self._by_channel_id = by_channel_id
+        self.sources_count = len(sources)
+
+    def detect(self, message) -> Optional[str]:
+        """Канал-источник сообщения или None"""
+        # Пересланный пост канала - самый точный признак
+        forward = getattr(message, 'fwd_from', None)
+        if forward is not None:
+            channel_id = getattr(forward.from_id, 'channel_id', None)
+            if channel_id in self._by_channel_id:
+                return self._by_channel_id[channel_id]
+
+        text = message.text if message else None
+        if not text:
+            return None
+        text = text.lower()
+
+        if self._automaton is None:
+            mentions = _MENTION_RE.findall(text)
+            return mentions[0] if mentions else None
+
+        # Первое совпадение, ограниченное границами слова
+        best = None
+        for start, end, source in self._automaton.search(text):
+            if end < len(text) and _is_word_char(text[end]):
+                continue
+            if text[start] == '@' and start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if best is None or start < best[0]:
+                best = (start, source)
+
+        return best[1] if best else None
+
+    async def refresh(self):
+        """Перечитать справочник каналов"""
+        try:
+            self.build(await get_channel_sources())
+            logger.info(f"🔗 Справочник каналов обновлен: {self.sources_count} источников")
+        except Exception as e:
+            logger.error(f"Ошибка обновления справочника каналов: {e}")
+
+    def start(self):
+        """Запустить фоновое обновление справочника"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        """Остановить фоновое обновление"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        """Периодическое перечитывание справочника"""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+
+# Общий движок для всех userbot'ов процесса
+attribution_engine = AttributionEngine()
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from config.supabase import save_conversations
+from config.settings import (
+    BACKUP_DIR, BATCH_MAX_ROWS, NEW_CLIENT_HOURS, RESPONSE_PENDING_TTL_HOURS, BACKFILL_DIALOG_CONCURRENCY
+)
+from core.batch_writer import CONVERSATION_DEFAULTS
+from core.channel_cache import channel_source_cache
+from core.local_store import local_store
+from core.stats_cache import closed_day_cache
+from core.rollup import hourly_rollup
+from core.scheduler import request_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Размер страницы запросов к Telegram
+PAGE_SIZE = 100
+
+
+def _local_time(value: datetime) -> datetime:
+    """Время Telegram (UTC) -> naive локальное время, как пишет datetime.now()"""
+    return value.astimezone().replace(tzinfo=None)
+
+
+class BackfillCheckpoint:
+    """Чекпоинты догрузки: какие интервалы времени каждого диалога уже загружены"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = asyncio.Lock()
+
+        # {manager_id: {dialog_id: [[начало, конец], ...]}} - интервалы без пересечений, по возрастанию
+        self._data = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                self._data = json.load(f)
+
+    def _ranges(self, manager_id: str, dialog_id: int) -> list[tuple[datetime, datetime]]:
+        return [
+            (datetime.fromisoformat(start), datetime.fromisoformat(end))
+            for start, end in self._data.get(manager_id, {}).get(str(dialog_id), [])
+        ]
+
+    def resume_from(self, manager_id: str, dialog_id: int, start: datetime, end: datetime) -> Optional[datetime]:
+        """С какого момента догружать диалог за [start, end]. None - интервал уже загружен целиком"""
+        for covered_start, covered_end in self._ranges(manager_id, dialog_id):
+            if covered_start <= start <= covered_end:
+                start = covered_end
+        return start if start < end else None
+
+    async def mark_done(self, manager_id: str, dialog_id: int, start: datetime, end: datetime):
+        """Отметить интервал диалога загруженным (атомарная запись файла)"""
+        async with self._lock:
+            merged = []
+            for covered_start, covered_end in sorted(self._ranges(manager_id, dialog_id) + [(start, end)]):
+                if merged and covered_start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], covered_end)
+                else:
+                    merged.append([covered_start, covered_end])
+
+            self._data.setdefault(manager_id, {})[str(dialog_id)] = [
+                [s.isoformat(), e.isoformat()] for s, e in merged
+            ]
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self._data, f)
+            tmp.replace(self.path)
+
+
+class HistoryBackfill:
+    """Догрузка истории личных диалогов за интервал времени по одному или всем менеджерам"""
+
+    def __init__(self, userbots: list, start: datetime, end: datetime,
+                 dialog_concurrency: int = BACKFILL_DIALOG_CONCURRENCY,
+                 checkpoint_path: Path = BACKUP_DIR / "backfill" / "dialogs.json"):
+        self.userbots = userbots
+        self.start = start
+        self.end = end
+        self.dialog_concurrency = dialog_concurrency
+        self.checkpoint = BackfillCheckpoint(checkpoint_path)
+
+        # Историю до начала интервала читаем, чтобы правильно определить новых клиентов и ожидания
+        self.lookback = timedelta(hours=max(NEW_CLIENT_HOURS, RESPONSE_PENDING_TTL_HOURS))
+
+        # Метрики
+        self.dialogs_done = 0
+        self.dialogs_skipped = 0
+        self.rows_loaded = 0
+
+    async def run(self) -> dict:
+        """Догрузить историю всех менеджеров параллельно"""
+        logger.info(f"⏪ Догрузка истории {self.start} - {self.end} для {len(self.userbots)} менеджеров...")
+
+        await asyncio.gather(*(self._backfill_manager(u) for u in self.userbots), return_exceptions=True)
+        await hourly_rollup.flush()
+        await local_store.flush()
+
+        stats = {
+            'dialogs_done': self.dialogs_done,
+            'dialogs_skipped': self.dialogs_skipped,
+            'rows_loaded': self.rows_loaded,
+        }
+        logger.info(f"✅ Догрузка завершена: {stats}")
+        return stats
+
+    async def _backfill_manager(self, userbot):
+        """Обойти личные диалоги одного аккаунта (не более dialog_concurrency одновременно)"""
+        semaphore = asyncio.Semaphore(self.dialog_concurrency)
+        tasks = []
+
+        try:
+            async for dialog in self._iter_dialogs(userbot):
+                if not dialog.is_user or dialog.entity.bot:
+                    continue
+                # Уже загруженная часть интервала (прерванный или пересекающийся запуск) пропускается
+                start = self.checkpoint.resume_from(userbot.manager_id, dialog.id, self.start, self.end)
+                if start is None:
+                    self.dialogs_skipped += 1
+                    continue
+
+                tasks.append(asyncio.create_task(self._backfill_dialog(userbot, dialog, start, semaphore)))
+
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            logger.error(f"Ошибка догрузки истории {userbot.manager_name}: {e}")
+            for task in tasks:
+                task.cancel()
+
+    async def _iter_dialogs(self, userbot):
+        """Диалоги, активные в интервале; каждая страница - фоновый запрос через планировщик"""
+        seen = set()
+        offset = {}
+        while True:
+            page = await request_scheduler.call(
+                userbot.manager_id, userbot.client.get_dialogs, limit=PAGE_SIZE, **offset
+            )
+            if not page:
+                return
+
+            for dialog in page:
+                # Диалоги идут от свежих к старым (кроме закрепленных) - дальше только неактивные
+                if dialog.date and _local_time(dialog.date) < self.start:
+                    if dialog.pinned:
+                        continue
+                    return
+                if dialog.id not in seen:
+                    seen.add(dialog.id)
+                    yield dialog
+
+            if len(page) < PAGE_SIZE:
+                return
+            last = page[-1]
+            offset = {
+                'offset_date': last.date,
+                'offset_id': last.message.id if last.message else 0,
+                'offset_peer': last.input_entity,
+            }
+
+    async def _iter_messages(self, userbot, entity, since: datetime):
+        """Сообщения диалога от старых к новым, постранично через планировщик"""
+        offset = {'offset_date': since.astimezone()}
+        while True:
+            page = await request_scheduler.call(
+                userbot.manager_id, userbot.client.get_messages, entity,
+                limit=PAGE_SIZE, reverse=True, **offset
+            )
+            for message in page:
+                yield message
+
+            if len(page) < PAGE_SIZE:
+                return
+            offset = {'offset_id': page[-1].id}
+
+    async def _backfill_dialog(self, userbot, dialog, start: datetime, semaphore: asyncio.Semaphore):
+        """Восстановить строки переписки одного диалога за [start, end] и загрузить их пачками"""
+        async with semaphore:
+            try:
+                rows, channel_source = await self._build_rows(userbot, dialog, start)
+
+                # Сообщения, уже записанные живым приемом или прошлой догрузкой, БД пропускает
+                written = []
+                for i in range(0, len(rows), BATCH_MAX_ROWS):
+                    chunk = await save_conversations(rows[i:i + BATCH_MAX_ROWS])
+                    local_store.add(chunk)
+                    await closed_day_cache.invalidate_rows(chunk)
+                    # В свертку - сразу после записи: если следующая пачка упадет, эта уже учтена
+                    for row in chunk:
+                        hourly_rollup.record(
+                            row['manager_id'], datetime.fromisoformat(row['message_time']),
+                            row['client_telegram_id'], row['message_type'],
+                            channel_source=channel_source, is_new=row['is_new_client'],
+                            response_time_minutes=row['response_time_minutes']
+                        )
+                    written.extend(chunk)
+                    self.rows_loaded += len(chunk)
+            except Exception as e:
+                # Диалог не отмечен в чекпоинте - будет загружен при следующем запуске
+                logger.error(f"Ошибка догрузки диалога {dialog.id} ({userbot.manager_name}): {e}")
+                return
+
+            await self.checkpoint.mark_done(userbot.manager_id, dialog.id, start, self.end)
+            self.dialogs_done += 1
+
+            if rows:
+                logger.info(f"⏪ [{userbot.manager_name}] Диалог {dialog.id}: {len(written)} сообщений "
+                            f"(уже были в БД: {len(rows) - len(written)})")
+
+    async def _build_rows(self, userbot, dialog, start: datetime) -> tuple[list[dict], Optional[str]]:
+        """Пройти сообщения по времени и восстановить новых клиентов, источник и время ответа"""
+        client_id = dialog.id
+        window = timedelta(hours=NEW_CLIENT_HOURS)
+        pending_ttl = timedelta(hours=RESPONSE_PENDING_TTL_HOURS)
+
+        last_seen: Optional[datetime] = None
+        pending_since: Optional[datetime] = None
+        channel_source = await channel_source_cache.get(userbot.manager_id, client_id)
+        rows = []
+
+        async for message in self._iter_messages(userbot, dialog.entity, start - self.lookback):
+            message_time = _local_time(message.date)
+            if message_time > self.end:
+                break
+
+            in_window = message_time >= start
+            text = message.text[:200] if message.text else None
+
+            if not message.out:
+                is_new = last_seen is None or message_time - last_seen > window
+                if channel_source is None:
+                    detected = await userbot.analyzer.detect_channel_source(message)
+                    if detected != 'unknown':
+                        channel_source = detected
+                pending_since = message_time
+
+                if in_window:
+                    rows.append({
+                        **CONVERSATION_DEFAULTS,
+                        'manager_id': userbot.manager_id,
+                        'manager_name': userbot.manager_name,
+                        'client_telegram_id': client_id,
+                        'message_time': message_time.isoformat(),
+                        'message_type': 'incoming',
+                        'is_new_client': is_new,
+                        'channel_source': channel_source or 'unknown',
+                        'message_text': text,
+                        'chat_id': client_id,
+                        'telegram_message_id': message.id
+                    })
+            else:
+                response_time_minutes = None
+                if pending_since is not None and message_time - pending_since <= pending_ttl:
+                    response_time_minutes = (message_time - pending_since).total_seconds() / 60
+                pending_since = None
+
+                if in_window:
+                    rows.append({
+                        **CONVERSATION_DEFAULTS,
+                        'manager_id': userbot.manager_id,
+                        'manager_name': userbot.manager_name,
+                        'client_telegram_id': client_id,
+                        'message_time': message_time.isoformat(),
+                        'message_type': 'outgoing',
+                        'response_time_minutes': response_time_minutes,
+                        'message_text': text,
+                        'chat_id': client_id,
+                        'telegram_message_id': message.id
+                    })
+
+            last_seen = message_time
+
+        return rows, channel_source
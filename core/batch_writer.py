@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from config.supabase import save_conversations
+from config.settings import (
+    BATCH_MAX_ROWS, BATCH_FLUSH_INTERVAL, BATCH_MAX_BACKOFF, SPOOL_ENABLED, SPOOL_PATH
+)
+from core.spool import ConversationSpool
+from core.local_store import local_store
+from core.stats_cache import closed_day_cache
+
+logger = logging.getLogger(__name__)
+
+# Все строки пачки должны иметь одинаковый набор колонок для bulk insert
+CONVERSATION_DEFAULTS = {
+    'is_new_client': False,
+    'channel_source': None,
+    'response_time_minutes': None,
+    'message_text': None,
+    'chat_id': None,
+    'telegram_message_id': None,
+}
+
+
+class MemoryQueue:
+    """Очередь строк в памяти (тот же интерфейс, что у ConversationSpool)"""
+
+    def __init__(self):
+        self._rows: list[dict] = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def append(self, rows: list[dict]):
+        self._rows.extend(rows)
+
+    def peek(self, limit: int) -> tuple[int, list[dict]]:
+        rows = self._rows[:limit]
+        return len(rows), rows
+
+    def ack(self, count: int):
+        del self._rows[:count]
+
+    def close(self):
+        pass
+
+
+class ConversationBatchWriter:
+    """Буфер отложенной записи переписок пачками (по размеру или по времени)"""
+
+    def __init__(self, max_rows: int = BATCH_MAX_ROWS, flush_interval: float = BATCH_FLUSH_INTERVAL,
+                 queue=None, queue_factory=MemoryQueue):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        # Очередь (журнал на диске) открывается при первом обращении, а не при импорте
+        self._queue = queue
+        self._queue_factory = queue_factory
+
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.rows_written = 0
+        self.duplicates_skipped = 0
+        self.flush_errors = 0
+        self.flush_count = 0
+        self.last_flush_latency = None
+        self.max_flush_latency = 0.0
+
+    @property
+    def queue(self):
+        """Очередь строк, ожидающих записи"""
+        if self._queue is None:
+            self._queue = self._queue_factory()
+        return self._queue
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество строк, ожидающих записи"""
+        return len(self.queue)
+
+    def start(self):
+        """Запустить фоновую отправку"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def add(self, data: dict):
+        """Добавить строку переписки (сначала в журнал, в БД - фоновой задачей)"""
+        self.queue.append([{**CONVERSATION_DEFAULTS, **data}])
+
+        if len(self.queue) >= self.max_rows:
+            self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """Отправить всё накопленное пачками. False - если БД недоступна"""
+        async with self._flush_lock:
+            while len(self.queue):
+                token, rows = self.queue.peek(self.max_rows)
+                if not rows:
+                    break
+
+                started = time.perf_counter()
+                try:
+                    written = await save_conversations(rows)
+                except Exception as e:
+                    # Строки остаются в очереди и уйдут при следующей попытке
+                    self.flush_errors += 1
+                    logger.error(f"Ошибка пакетной записи переписок ({len(rows)} строк): {e}")
+                    return False
+                finally:
+                    latency = time.perf_counter() - started
+                    self.flush_count += 1
+                    self.last_flush_latency = latency
+                    self.max_flush_latency = max(self.max_flush_latency, latency)
+
+                self.queue.ack(token)
+                self.rows_written += len(written)
+                # Строки, уже бывшие в БД (повтор пачки после сбоя), - не ошибка
+                self.duplicates_skipped += len(rows) - len(written)
+
+                # Локальное аналитическое зеркало получает только записанное в БД
+                local_store.add(written)
+                # Поздние строки (повтор из журнала после простоя) открывают закрытые дни
+                await closed_day_cache.invalidate_rows(written)
+
+        return True
+
+    async def stop(self):
+        """Остановить фоновую отправку и записать остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+        logger.info(f"💾 Буфер переписок сброшен (записано: {self.rows_written}, "
+                    f"осталось в очереди: {self.queue_depth})")
+
+    def get_stats(self) -> dict:
+        """Получить метрики буфера"""
+        return {
+            'queue_depth': self.queue_depth,
+            'rows_written': self.rows_written,
+            'duplicates_skipped': self.duplicates_skipped,
+            'flush_errors': self.flush_errors,
+            'flush_count': self.flush_count,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+        }
+
+    async def _flush_loop(self):
+        """Периодическая отправка; при недоступной БД - с растущей паузой"""
+        ok = True
+        delay = self.flush_interval
+        while True:
+            if ok:
+                # Ждем либо наполнения пачки, либо интервала
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(delay)
+            self._wakeup.clear()
+
+            try:
+                ok = await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой отправки буфера: {e}")
+                ok = False
+
+            delay = self.flush_interval if ok else min(delay * 2, BATCH_MAX_BACKOFF)
+
+
+def _create_queue():
+    """Журнал на диске (если включен) или очередь в памяти"""
+    if SPOOL_ENABLED:
+        return ConversationSpool(SPOOL_PATH)
+    return MemoryQueue()
+
+
+# Общий буфер для всех userbot'ов процесса
+conversation_writer = ConversationBatchWriter(queue_factory=_create_queue)
@@ -0,0 +1,77 @@
+import logging
+from collections import OrderedDict
+from typing import Optional
+from config.supabase import get_client_channel_source
+from config.settings import CHANNEL_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class ChannelSourceCache:
+    """LRU-кэш атрибуции клиента: (manager_id, client_telegram_id) -> канал"""
+
+    def __init__(self, max_entries: int = CHANNEL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, int], Optional[str]] = OrderedDict()
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, manager_id: str, client_id: int) -> Optional[str]:
+        """Канал клиента; при промахе - один запрос одной колонки одной строки"""
+        key = (manager_id, client_id)
+        channel = self._entries.get(key, _MISSING)
+
+        if channel is not _MISSING:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return channel
+
+        self.misses += 1
+        try:
+            channel = await get_client_channel_source(client_id, manager_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения источника клиента: {e}")
+            return None
+
+        # None тоже кэшируем: клиент без атрибуции не должен ходить в БД каждый раз
+        self._store(key, channel)
+        return channel
+
+    def peek(self, manager_id: str, client_id: int) -> Optional[str]:
+        """Канал клиента, если он уже в кэше (без запроса к БД)"""
+        return self._entries.get((manager_id, client_id))
+
+    def set(self, manager_id: str, client_id: int, channel: str):
+        """Запомнить канал клиента (только если атрибуции еще нет)"""
+        key = (manager_id, client_id)
+        if self._entries.get(key) is None:
+            self._store(key, channel)
+
+    def get_stats(self) -> dict:
+        """Получить метрики кэша"""
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _store(self, key: tuple[str, int], channel: Optional[str]):
+        self._entries[key] = channel
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# Общий кэш для всех userbot'ов процесса
+channel_source_cache = ChannelSourceCache()
@@ -0,0 +1,119 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from config.supabase import parse_time
+from config.settings import NEW_CLIENT_HOURS
+from core.client_store import ClientStateTable
+
+logger = logging.getLogger(__name__)
+
+# Время последнего сообщения - секунды Unix в uint32 (хватит до 2106 года)
+LAST_SEEN_COLUMNS = {'last_seen': 'I'}
+
+
+def _seconds(value: datetime) -> int:
+    """Naive локальное время -> секунды Unix (упаковываются в uint32)"""
+    return int(value.timestamp())
+
+
+class LastSeenIndex:
+    """Индекс (manager_id, client_telegram_id) -> время последнего сообщения (компактные таблицы по менеджерам)"""
+
+    def __init__(self, hours: int = NEW_CLIENT_HOURS):
+        self.window = timedelta(hours=hours)
+        self._window_seconds = int(self.window.total_seconds())
+        self._tables: dict[str, ClientStateTable] = {}
+        self.is_warm = False
+
+    def __len__(self):
+        return sum(len(table) for table in self._tables.values())
+
+    @property
+    def nbytes(self) -> int:
+        """Память под массивы индекса"""
+        return sum(table.nbytes for table in self._tables.values())
+
+    def get(self, manager_id: str, client_id: int) -> Optional[datetime]:
+        """Время последнего сообщения в переписке с клиентом"""
+        table = self._tables.get(manager_id)
+        seen = table.get(client_id, 'last_seen') if table is not None else 0
+        return datetime.fromtimestamp(seen) if seen else None
+
+    def is_new(self, manager_id: str, client_id: int, message_time: datetime) -> Optional[bool]:
+        """Новый ли клиент (не писал более окна). None - индекс не прогрет и клиента в нем нет"""
+        table = self._tables.get(manager_id)
+        seen = table.get(client_id, 'last_seen') if table is not None else 0
+        if not seen:
+            return True if self.is_warm else None
+        return _seconds(message_time) - seen > self._window_seconds
+
+    def _writable(self, manager_id: str) -> ClientStateTable:
+        """Таблица менеджера для записи (снимок через mmap копируется в память при первом изменении)"""
+        table = self._tables.get(manager_id)
+        if table is None:
+            table = self._tables[manager_id] = ClientStateTable(LAST_SEEN_COLUMNS)
+        elif table.readonly:
+            table = self._tables[manager_id] = table.copy()
+        return table
+
+    def touch(self, manager_id: str, client_id: int, message_time: datetime):
+        """Отметить сообщение в переписке с клиентом"""
+        table = self._writable(manager_id)
+
+        seconds = _seconds(message_time)
+        if seconds > table.get(client_id, 'last_seen'):
+            table.set(client_id, 'last_seen', seconds)
+
+    def prune(self, now: datetime = None) -> int:
+        """Удалить записи старше окна (они уже ничего не решают)"""
+        cutoff = _seconds(now or datetime.now()) - self._window_seconds
+        return sum(self._writable(manager_id).retain('last_seen', cutoff) for manager_id in list(self._tables))
+
+    def load(self, rows: list[dict]):
+        """Прогреть индекс строками за последние NEW_CLIENT_HOURS (один bulk-запрос)"""
+        for row in rows:
+            self.touch(row['manager_id'], row['client_telegram_id'], parse_time(row['message_time']))
+
+        self.is_warm = True
+        logger.info(f"🗂️ Индекс клиентов прогрет: {len(self)} переписок ({self.nbytes // 1024} КБ)")
+
+    def save_snapshot(self, directory: Path, manager_ids: list[str]):
+        """Снимок индекса при остановке: по файлу на менеджера"""
+        for manager_id in manager_ids:
+            table = self._tables.get(manager_id) or ClientStateTable(LAST_SEEN_COLUMNS)
+            table.save(Path(directory) / f"{manager_id}.cst")
+        logger.info(f"💾 Снимок индекса клиентов: {len(manager_ids)} менеджеров")
+
+    def load_snapshot(self, directory: Path, manager_ids: list[str]) -> bool:
+        """Открыть снимки менеджеров через mmap. True - снимки есть у всех и моложе окна: индекс прогрет.
+
+        Снимок пишется только при штатной остановке, поэтому при загрузке он удаляется:
+        после падения процесса индекс прогревается из БД, а не устаревшим снимком.
+        """
+        paths = [Path(directory) / f"{manager_id}.cst" for manager_id in manager_ids]
+        fresh = bool(paths) and all(
+            path.exists() and time.time() - path.stat().st_mtime < self._window_seconds for path in paths
+        )
+
+        for manager_id, path in zip(manager_ids, paths):
+            if not path.exists():
+                continue
+            try:
+                if fresh and manager_id not in self._tables:
+                    # Страницы снимка читаются по мере обращения, копия - при первом изменении
+                    self._tables[manager_id] = ClientStateTable.load(path, use_mmap=True)
+                path.unlink()
+            except Exception as e:
+                logger.error(f"Ошибка загрузки снимка индекса {manager_id}: {e}")
+                fresh = False
+
+        if fresh:
+            self.is_warm = True
+            logger.info(f"🗂️ Индекс клиентов открыт из снимка: {len(self)} переписок")
+        return fresh
+
+
+# Общий индекс для всех userbot'ов процесса
+last_seen_index = LastSeenIndex()
@@ -0,0 +1,192 @@
+import mmap
+import struct
+from array import array
+from pathlib import Path
+from typing import Iterator
+
+# ID клиента 0 в Telegram не встречается - им помечаем пустые ячейки
+EMPTY = 0
+# Заполненность, после которой таблица удваивается
+MAX_LOAD = 0.7
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+# Снимок: заголовок, затем ключи и колонки подряд (каждый блок выровнен по 8 байт)
+_MAGIC = b'CSTB'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHQQ')  # magic, версия, число колонок, емкость, размер
+_COLUMN = struct.Struct('<32sc')    # имя колонки, typecode
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class ClientStateTable:
+    """Состояние клиентов в массивах: открытая адресация по int64 ID, значения - упакованные колонки"""
+
+    def __init__(self, columns: dict[str, str], capacity: int = 1024):
+        self.columns = dict(columns)
+        self._allocate(max(8, 1 << (capacity - 1).bit_length()))
+        self.readonly = False
+
+    def _allocate(self, capacity: int):
+        self._capacity = capacity
+        self._mask = capacity - 1
+        self._shift = 64 - (capacity.bit_length() - 1)
+        self._size = 0
+        self._keys = array('q', bytes(8 * capacity))
+        self._values = {
+            name: array(code, bytes(array(code).itemsize * capacity))
+            for name, code in self.columns.items()
+        }
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, client_id: int):
+        return self._keys[self._slot(client_id)] == client_id
+
+    @property
+    def nbytes(self) -> int:
+        """Размер массивов таблицы в байтах"""
+        return self._keys.itemsize * self._capacity + sum(
+            values.itemsize * self._capacity for values in self._values.values()
+        )
+
+    def _slot(self, client_id: int) -> int:
+        """Ячейка клиента или первая свободная ячейка на его цепочке (линейное пробирование)"""
+        keys, mask = self._keys, self._mask
+        # Фибоначчиево хеширование: ID Telegram идут почти подряд
+        i = ((client_id * _GOLDEN) & _MASK64) >> self._shift
+        while True:
+            key = keys[i]
+            if key == client_id or key == EMPTY:
+                return i
+            i = (i + 1) & mask
+
+    def get(self, client_id: int, column: str) -> int:
+        """Значение колонки (0 - клиента нет или значение не задано)"""
+        i = self._slot(client_id)
+        return self._values[column][i] if self._keys[i] == client_id else 0
+
+    def set(self, client_id: int, column: str, value: int):
+        """Записать значение колонки (клиент добавляется при необходимости)"""
+        if self.readonly:
+            raise TypeError("Снимок открыт только для чтения")
+
+        i = self._slot(client_id)
+        if self._keys[i] != client_id:
+            if (self._size + 1) > self._capacity * MAX_LOAD:
+                self._resize(self._capacity * 2)
+                i = self._slot(client_id)
+            self._keys[i] = client_id
+            self._size += 1
+        self._values[column][i] = value
+
+    def items(self, column: str) -> Iterator[tuple[int, int]]:
+        """Пары (ID клиента, значение колонки)"""
+        values = self._values[column]
+        for i, key in enumerate(self._keys):
+            if key != EMPTY:
+                yield key, values[i]
+
+    def retain(self, column: str, min_value: int) -> int:
+        """Оставить клиентов со значением колонки не меньше min_value (таблица пересобирается и ужимается)"""
+        if self.readonly:
+            raise TypeError("Снимок открыт только для чтения")
+
+        survivors = [
+            (i, key) for i, key in enumerate(self._keys)
+            if key != EMPTY and self._values[column][i] >= min_value
+        ]
+        removed = self._size - len(survivors)
+        if removed:
+            capacity = max(8, 1 << int(len(survivors) / MAX_LOAD * 1.5).bit_length())
+            self._rebuild(capacity, survivors)
+        return removed
+
+    def copy(self) -> 'ClientStateTable':
+        """Изменяемая копия в памяти (например, снимка, открытого через mmap)"""
+        table = ClientStateTable.__new__(ClientStateTable)
+        table.columns = dict(self.columns)
+        table._capacity = self._capacity
+        table._mask = self._mask
+        table._shift = self._shift
+        table._size = self._size
+        table._keys = array('q', self._keys.tobytes())
+        table._values = {
+            name: array(self.columns[name], values.tobytes()) for name, values in self._values.items()
+        }
+        table.readonly = False
+        return table
+
+    def _resize(self, capacity: int):
+        self._rebuild(capacity, [(i, key) for i, key in enumerate(self._keys) if key != EMPTY])
+
+    def _rebuild(self, capacity: int, entries: list[tuple[int, int]]):
+        old_values = self._values
+        self._allocate(capacity)
+        for old_slot, key in entries:
+            i = self._slot(key)
+            self._keys[i] = key
+            for name, values in self._values.items():
+                values[i] = old_values[name][old_slot]
+        self._size = len(entries)
+
+    def save(self, path: Path):
+        """Записать снимок на диск (атомарно через временный файл)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(self.columns), self._capacity, self._size))
+            for name, code in self.columns.items():
+                f.write(_COLUMN.pack(name.encode(), code.encode()))
+            for block in (self._keys, *self._values.values()):
+                f.write(bytes(_align(f.tell()) - f.tell()))
+                f.write(block.tobytes())
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, use_mmap: bool = False) -> 'ClientStateTable':
+        """Прочитать снимок: в память (изменяемый) или через mmap (только чтение, без копирования)"""
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_columns, capacity, size = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path}: не снимок ClientStateTable")
+
+        offset = _HEADER.size
+        columns = {}
+        for _ in range(n_columns):
+            name, code = _COLUMN.unpack_from(data, offset)
+            columns[name.rstrip(b'\0').decode()] = code.decode()
+            offset += _COLUMN.size
+
+        table = cls.__new__(cls)
+        table.columns = columns
+        table._capacity = capacity
+        table._mask = capacity - 1
+        table._shift = 64 - (capacity.bit_length() - 1)
+        table._size = size
+        table.readonly = use_mmap
+
+        view = memoryview(data) if use_mmap else None
+        blocks = []
+        for code in ('q', *columns.values()):
+            offset = _align(offset)
+            length = array(code).itemsize * capacity
+            if use_mmap:
+                blocks.append(view[offset:offset + length].cast(code))
+            else:
+                blocks.append(array(code, data[offset:offset + length]))
+            offset += length
+
+        table._keys = blocks[0]
+        table._values = dict(zip(columns, blocks[1:]))
+        if not use_mmap:
+            data.close()
+        return table
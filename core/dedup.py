@@ -0,0 +1,61 @@
+import logging
+from collections import OrderedDict
+from typing import Optional
+from config.settings import RECENT_MESSAGES_MAX
+
+logger = logging.getLogger(__name__)
+
+
+class RecentMessageFilter:
+    """Недавно обработанные сообщения (manager_id, chat_id, message_id): повторы отбрасываются до записи в БД"""
+
+    def __init__(self, max_entries: int = RECENT_MESSAGES_MAX):
+        self.max_entries = max_entries
+        # Порядок вставки: при переполнении вытесняются самые старые
+        self._seen: OrderedDict[tuple[str, int, int], None] = OrderedDict()
+
+        # Метрики
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def seen(self, manager_id: str, chat_id: int, message_id: Optional[int]) -> bool:
+        """Проверить, обрабатывалось ли уже сообщение (повтор события). Само сообщение не запоминается"""
+        if message_id is None or (manager_id, chat_id, message_id) not in self._seen:
+            return False
+        self.duplicates += 1
+        return True
+
+    def add(self, manager_id: str, chat_id: int, message_id: Optional[int]) -> bool:
+        """Запомнить сообщение. False - оно уже обрабатывалось (повтор события)"""
+        if message_id is None:
+            return True
+
+        key = (manager_id, chat_id, message_id)
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+
+        self._seen[key] = None
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return True
+
+    def load(self, rows: list[dict]):
+        """Прогреть фильтр недавними строками из БД (повторы после рестарта не дойдут до записи)"""
+        for row in rows:
+            if row.get('telegram_message_id') is not None:
+                self.add(row['manager_id'], row['chat_id'], row['telegram_message_id'])
+        logger.info(f"🧷 Фильтр повторов прогрет: {len(self._seen)} сообщений")
+
+    def get_stats(self) -> dict:
+        """Получить метрики фильтра"""
+        return {
+            'size': len(self._seen),
+            'duplicates': self.duplicates,
+        }
+
+
+# Общий фильтр для всех userbot'ов процесса
+recent_messages = RecentMessageFilter()
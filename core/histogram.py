@@ -0,0 +1,97 @@
+import math
+from typing import Optional
+
+# Логарифмические корзины: соседние границы отличаются на 5%,
+# поэтому любой перцентиль восстанавливается с относительной ошибкой ~2.5%
+_GROWTH = 1.05
+_LOG_GROWTH = math.log(_GROWTH)
+
+
+class ResponseTimeHistogram:
+    """Компактная сливаемая гистограмма времени ответа (HDR-подобные корзины, секунды)"""
+
+    def __init__(self):
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def __len__(self):
+        return self.count
+
+    def add(self, seconds: float, count: int = 1):
+        """Добавить значение"""
+        seconds = max(float(seconds), 0.0)
+        index = self._index(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += seconds * count
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other: 'ResponseTimeHistogram'):
+        """Слить другую гистограмму в эту"""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def mean(self) -> Optional[float]:
+        """Среднее значение (точное, по сумме)"""
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Значение перцентиля q (0..1)"""
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        """Сериализация для JSONB-колонки"""
+        return {
+            'buckets': {str(index): count for index, count in sorted(self.buckets.items())},
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'ResponseTimeHistogram':
+        """Восстановить из JSONB-колонки"""
+        histogram = cls()
+        if not data:
+            return histogram
+
+        histogram.buckets = {int(index): count for index, count in data.get('buckets', {}).items()}
+        histogram.count = data.get('count', 0)
+        histogram.total = data.get('sum', 0.0)
+        histogram.min = data.get('min')
+        histogram.max = data.get('max')
+        return histogram
+
+    @staticmethod
+    def _index(seconds: float) -> int:
+        # Корзина 0 - всё меньше секунды
+        if seconds < 1:
+            return 0
+        return int(math.log(seconds) / _LOG_GROWTH) + 1
+
+    @staticmethod
+    def _value(index: int) -> float:
+        # Середина корзины [GROWTH^(i-1), GROWTH^i)
+        if index == 0:
+            return 0.5
+        return _GROWTH ** (index - 0.5)
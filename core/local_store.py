@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional
+from config.settings import (
+    LOCAL_STORE_ENABLED, LOCAL_STORE_DIR, LOCAL_STORE_FLUSH_ROWS, LOCAL_STORE_FLUSH_INTERVAL, SHARD_INDEX
+)
+
+try:
+    import duckdb
+except ImportError:  # зеркало необязательное: без duckdb просто выключено
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# Колонки зеркала (текст сообщений не храним - для отчетов он не нужен)
+COLUMNS = (
+    ('manager_id', 'VARCHAR'),
+    ('manager_name', 'VARCHAR'),
+    ('client_telegram_id', 'BIGINT'),
+    ('message_time', 'TIMESTAMP'),
+    ('message_type', 'VARCHAR'),
+    ('is_new_client', 'BOOLEAN'),
+    ('channel_source', 'VARCHAR'),
+    ('response_time_minutes', 'DOUBLE'),
+)
+
+# Измерения запросов: имя -> SQL-выражение (только из этого списка, без пользовательского SQL)
+DIMENSIONS = {
+    'manager_id': "manager_id",
+    'manager_name': "manager_name",
+    'channel_source': "coalesce(channel_source, 'unknown')",
+    'message_type': "message_type",
+    'month': "CAST(date_trunc('month', message_time) AS DATE)",
+    'week': "CAST(date_trunc('week', message_time) AS DATE)",
+    'day': "CAST(message_time AS DATE)",
+    'hour': "date_trunc('hour', message_time)",
+    'hour_of_day': "hour(message_time)",
+    'weekday': "isodow(message_time)",
+}
+
+# Метрики агрегатов
+METRICS = """
+    count(*) FILTER (WHERE message_type = 'incoming') AS messages_received,
+    count(*) FILTER (WHERE message_type = 'outgoing') AS messages_sent,
+    count(DISTINCT client_telegram_id) AS unique_clients,
+    count(DISTINCT client_telegram_id) FILTER (WHERE is_new_client) AS new_clients,
+    avg(response_time_minutes) FILTER (WHERE response_time_minutes > 0) AS avg_response_time,
+    quantile_cont(response_time_minutes, 0.5) FILTER (WHERE response_time_minutes > 0) AS p50_response_time,
+    quantile_cont(response_time_minutes, 0.9) FILTER (WHERE response_time_minutes > 0) AS p90_response_time
+"""
+
+
+class LocalAnalyticsStore:
+    """Локальное колоночное зеркало переписок: Parquet-файлы по дням, запросы через DuckDB"""
+
+    def __init__(self, root: Path = LOCAL_STORE_DIR, flush_rows: int = LOCAL_STORE_FLUSH_ROWS,
+                 flush_interval: float = LOCAL_STORE_FLUSH_INTERVAL, enabled: bool = LOCAL_STORE_ENABLED):
+        self.root = Path(root)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.enabled = enabled and duckdb is not None
+
+        self._buffer: list[tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # DuckDB - в одном отдельном потоке, чтобы не блокировать event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-store")
+
+        # Метрики
+        self.rows_written = 0
+        self.files_written = 0
+
+        if enabled and duckdb is None:
+            logger.warning("⚠️ LOCAL_STORE_ENABLED, но пакет duckdb не установлен - локальное зеркало выключено")
+
+    @property
+    def conversations_path(self) -> Path:
+        return self.root / "conversations"
+
+    def add(self, rows: list[dict]):
+        """Добавить строки, уже записанные в Supabase"""
+        if not self.enabled:
+            return
+
+        self._buffer.extend(self._to_tuple(row) for row in rows)
+
+        if len(self._buffer) >= self.flush_rows:
+            self._wakeup.set()
+
+    def start(self):
+        """Запустить периодическую запись файлов"""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def flush(self):
+        """Записать накопленные строки: по одному Parquet-файлу на день"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+
+            rows, self._buffer = self._buffer, []
+            loop = asyncio.get_running_loop()
+            try:
+                files = await loop.run_in_executor(self._executor, self._write_parts, rows)
+            except Exception as e:
+                # Зеркало вспомогательное: при ошибке диска строки возвращаем и пробуем позже
+                self._buffer[:0] = rows
+                logger.error(f"Ошибка записи локального зеркала ({len(rows)} строк): {e}")
+                return
+
+            self.rows_written += len(rows)
+            self.files_written += files
+
+    async def stop(self):
+        """Остановить периодическую запись и записать остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self.enabled:
+            await self.flush()
+
+    async def compact(self, before: date) -> int:
+        """Слить файлы своего шарда за закрытые дни (до before) в один файл на день"""
+        if not self.enabled:
+            return 0
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._compact, before)
+
+    async def replace_day(self, day: date, rows: list[dict]) -> int:
+        """Заменить данные дня строками из Supabase (первичная загрузка или сверка зеркала)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._replace_day, day, [self._to_tuple(r) for r in rows])
+
+    async def query(self, sql: str, params: Optional[list] = None) -> list[dict]:
+        """Произвольный SQL по представлению conversations"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._query, sql, params or [])
+
+    async def aggregate(self, start: datetime, end: datetime, group_by: tuple = ('manager_id',),
+                        manager_ids: Optional[list[str]] = None,
+                        channel_sources: Optional[list[str]] = None) -> list[dict]:
+        """Агрегаты за интервал [start, end) в разрезе измерений (см. DIMENSIONS)"""
+        unknown = [d for d in group_by if d not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Неизвестные измерения: {unknown}. Доступны: {list(DIMENSIONS)}")
+
+        where = ["message_time >= ?", "message_time < ?"]
+        params: list = [start, end]
+        if manager_ids:
+            where.append(f"manager_id IN ({', '.join('?' * len(manager_ids))})")
+            params.extend(manager_ids)
+        if channel_sources:
+            where.append(f"coalesce(channel_source, 'unknown') IN ({', '.join('?' * len(channel_sources))})")
+            params.extend(channel_sources)
+
+        select = [f"{DIMENSIONS[d]} AS {d}" for d in group_by]
+        sql = f"SELECT {', '.join(select + [METRICS])} FROM conversations WHERE {' AND '.join(where)}"
+        if group_by:
+            positions = ', '.join(str(i) for i in range(1, len(group_by) + 1))
+            sql += f" GROUP BY {positions} ORDER BY {positions}"
+
+        return await self.query(sql, params)
+
+    def get_stats(self) -> dict:
+        """Получить метрики зеркала"""
+        return {
+            'enabled': self.enabled,
+            'buffered_rows': len(self._buffer),
+            'rows_written': self.rows_written,
+            'files_written': self.files_written,
+        }
+
+    async def _flush_loop(self):
+        """Периодическая запись и уплотнение вчерашних файлов"""
+        compacted_before = None
+        while True:
+            # Ждем либо наполнения буфера, либо интервала
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+
+                today = date.today()
+                if compacted_before != today:
+                    merged = await self.compact(today)
+                    compacted_before = today
+                    if merged:
+                        logger.info(f"🗜️ Локальное зеркало: уплотнено дней: {merged}")
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи локального зеркала: {e}")
+
+    @staticmethod
+    def _to_tuple(row: dict) -> tuple:
+        message_time = row['message_time']
+        if isinstance(message_time, str):
+            message_time = datetime.fromisoformat(message_time).replace(tzinfo=None)
+        return (
+            row['manager_id'], row.get('manager_name'), row['client_telegram_id'], message_time,
+            row['message_type'], bool(row.get('is_new_client')), row.get('channel_source'),
+            row.get('response_time_minutes'),
+        )
+
+    # Синхронная часть - выполняется в потоке self._executor
+
+    def _connect(self):
+        if duckdb is None:
+            raise RuntimeError("Для локального зеркала нужен пакет duckdb")
+        return duckdb.connect()
+
+    def _write_parts(self, rows: list[tuple]) -> int:
+        by_day: dict[date, list[tuple]] = {}
+        for row in rows:
+            by_day.setdefault(row[3].date(), []).append(row)
+
+        con = self._connect()
+        try:
+            columns = ', '.join(f"{name} {kind}" for name, kind in COLUMNS)
+            placeholders = ', '.join('?' * len(COLUMNS))
+            for day, day_rows in by_day.items():
+                con.execute(f"CREATE OR REPLACE TEMP TABLE part ({columns})")
+                con.executemany(f"INSERT INTO part VALUES ({placeholders})", day_rows)
+
+                directory = self.conversations_path / f"date={day.isoformat()}"
+                directory.mkdir(parents=True, exist_ok=True)
+                path = directory / f"part-{SHARD_INDEX}-{time.time_ns()}.parquet"
+                self._copy_to(con, "SELECT * FROM part ORDER BY message_time", path)
+        finally:
+            con.close()
+
+        return len(by_day)
+
+    def _compact(self, before: date) -> int:
+        if not self.conversations_path.exists():
+            return 0
+
+        merged = 0
+        con = self._connect()
+        try:
+            for directory in sorted(self.conversations_path.glob("date=*")):
+                if date.fromisoformat(directory.name[len("date="):]) >= before:
+                    continue
+                parts = sorted(directory.glob(f"part-{SHARD_INDEX}-*.parquet"))
+                if len(parts) < 2:
+                    continue
+
+                files = ', '.join(f"'{p}'" for p in parts)
+                path = directory / f"part-{SHARD_INDEX}-{time.time_ns()}.parquet"
+                self._copy_to(con, f"SELECT * FROM read_parquet([{files}]) ORDER BY message_time", path)
+                for part in parts:
+                    part.unlink()
+                merged += 1
+        finally:
+            con.close()
+
+        return merged
+
+    def _copy_to(self, con, select: str, path: Path):
+        # Пишем во временный файл и переименовываем: читатели не увидят недописанный Parquet
+        tmp = path.with_suffix('.tmp')
+        con.execute(f"COPY ({select}) TO '{tmp}' (FORMAT PARQUET)")
+        tmp.replace(path)
+
+    def _replace_day(self, day: date, rows: list[tuple]) -> int:
+        directory = self.conversations_path / f"date={day.isoformat()}"
+        old_parts = list(directory.glob("*.parquet")) if directory.exists() else []
+
+        if rows:
+            self._write_parts(rows)
+        for part in old_parts:
+            part.unlink()
+        return len(rows)
+
+    def _query(self, sql: str, params: list) -> list[dict]:
+        con = self._connect()
+        try:
+            pattern = self.conversations_path / "*" / "*.parquet"
+            if any(self.conversations_path.glob("*/*.parquet")):
+                con.execute(f"CREATE VIEW conversations AS SELECT * FROM read_parquet('{pattern}')")
+            else:
+                columns = ', '.join(f"{name} {kind}" for name, kind in COLUMNS)
+                con.execute(f"CREATE TABLE conversations ({columns})")
+
+            result = con.execute(sql, params)
+            names = [column[0] for column in result.description]
+            return [dict(zip(names, row)) for row in result.fetchall()]
+        finally:
+            con.close()
+
+
+# Общее локальное зеркало для всех userbot'ов процесса
+local_store = LocalAnalyticsStore()
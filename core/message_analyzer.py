@@ -1,8 +1,16 @@
 import logging
 from datetime import datetime
 from typing import Optional, Dict
-from config.supabase import save_conversation, is_new_client, get_client_history
+from config.supabase import is_new_client
 from config.settings import NEW_CLIENT_HOURS
+from core.batch_writer import conversation_writer
+from core.client_index import last_seen_index
+from core.channel_cache import channel_source_cache
+from core.response_tracker import PendingResponseTracker
+from core.aggregator import daily_stats_aggregator
+from core.rollup import hourly_rollup
+from core.attribution import attribution_engine
+from core.dedup import recent_messages
 
 logger = logging.getLogger(__name__)
 
@@ -12,23 +20,35 @@ class MessageAnalyzer:
     def __init__(self, manager_id: str, manager_name: str):
         self.manager_id = manager_id
         self.manager_name = manager_name
-        self.response_times = {}  # client_id -> last_client_message_time
+        self.pending_responses = PendingResponseTracker()  # client_id -> last_client_message_time
 
     async def analyze_incoming_message(self, event):
         """Анализ входящего сообщения от клиента"""
         try:
+            # Повтор того же события (переподключение, догрузка пропущенных обновлений);
+            # сообщение запоминается только после передачи на запись - упавшая обработка повтор не отбросит
+            if recent_messages.seen(self.manager_id, event.chat_id, event.message.id):
+                logger.debug(f"🔁 [{self.manager_name}] Повтор сообщения {event.message.id} - пропуск")
+                return
+
             client_id = event.sender_id
             message_time = datetime.now()
 
-            # Определяем, новый ли это клиент
-            is_new = await is_new_client(client_id, self.manager_id, NEW_CLIENT_HOURS)
+            # Определяем, новый ли это клиент (по индексу в памяти, БД - только если индекс не прогрет)
+            is_new = last_seen_index.is_new(self.manager_id, client_id, message_time)
+            if is_new is None:
+                is_new = await is_new_client(client_id, self.manager_id, NEW_CLIENT_HOURS)
+            last_seen_index.touch(self.manager_id, client_id, message_time)
 
-            # Получаем историю для определения источника
-            history = await get_client_history(client_id, self.manager_id)
-            channel_source = await self._detect_channel_source(event, history)
+            # Источник фиксируется один раз, при первом контакте
+            channel_source = await channel_source_cache.get(self.manager_id, client_id)
+            if not channel_source:
+                channel_source = await self.detect_channel_source(event.message)
+                if channel_source != 'unknown':
+                    channel_source_cache.set(self.manager_id, client_id, channel_source)
 
             # Сохраняем время сообщения для расчета времени ответа
-            self.response_times[client_id] = message_time
+            self.pending_responses.mark(client_id, message_time)
 
             # Сохраняем в базу
             data = {
@@ -39,10 +59,21 @@ class MessageAnalyzer:
                 'message_type': 'incoming',
                 'is_new_client': is_new,
                 'channel_source': channel_source,
-                'message_text': event.message.text[:200] if event.message and event.message.text else None
+                'message_text': event.message.text[:200] if event.message and event.message.text else None,
+                'chat_id': event.chat_id,
+                'telegram_message_id': event.message.id
             }
 
-            await save_conversation(data)
+            await conversation_writer.add(data)
+            recent_messages.add(self.manager_id, event.chat_id, event.message.id)
+            daily_stats_aggregator.record(
+                self.manager_id, message_time, client_id, 'incoming', is_new=is_new,
+                message_key=(event.chat_id, event.message.id)
+            )
+            hourly_rollup.record(
+                self.manager_id, message_time, client_id, 'incoming',
+                channel_source=channel_source, is_new=is_new
+            )
 
             logger.info(f"📩 [{self.manager_name}] Входящее от клиента {client_id} (новый: {is_new})")
 
@@ -58,14 +89,19 @@ class MessageAnalyzer:
             else:
                 return  # Игнорируем групповые чаты
 
+            if recent_messages.seen(self.manager_id, event.chat_id, event.message.id):
+                logger.debug(f"🔁 [{self.manager_name}] Повтор сообщения {event.message.id} - пропуск")
+                return
+
             message_time = datetime.now()
+            last_seen_index.touch(self.manager_id, client_id, message_time)
 
             # Рассчитываем время ответа
             response_time_minutes = None
-            if client_id in self.response_times:
-                delta = message_time - self.response_times[client_id]
+            client_message_time = self.pending_responses.pop(client_id)  # Убираем из очереди
+            if client_message_time is not None:
+                delta = message_time - client_message_time
                 response_time_minutes = delta.total_seconds() / 60
-                del self.response_times[client_id]  # Убираем из очереди
 
             # Сохраняем в базу
             data = {
@@ -75,36 +111,34 @@ class MessageAnalyzer:
                 'message_time': message_time.isoformat(),
                 'message_type': 'outgoing',
                 'response_time_minutes': response_time_minutes,
-                'message_text': event.message.text[:200] if event.message and event.message.text else None
+                'message_text': event.message.text[:200] if event.message and event.message.text else None,
+                'chat_id': event.chat_id,
+                'telegram_message_id': event.message.id
             }
 
-            await save_conversation(data)
-
-            logger.info(f"📤 [{self.manager_name}] Исходящее клиенту {client_id} (время ответа: {response_time_minutes:.1f} мин)")
+            await conversation_writer.add(data)
+            recent_messages.add(self.manager_id, event.chat_id, event.message.id)
+            daily_stats_aggregator.record(
+                self.manager_id, message_time, client_id, 'outgoing',
+                response_time_minutes=response_time_minutes,
+                message_key=(event.chat_id, event.message.id)
+            )
+            hourly_rollup.record(
+                self.manager_id, message_time, client_id, 'outgoing',
+                channel_source=channel_source_cache.peek(self.manager_id, client_id),
+                response_time_minutes=response_time_minutes
+            )
+
+            response_time = f"{response_time_minutes:.1f} мин" if response_time_minutes is not None else "нет ожидания"
+            logger.info(f"📤 [{self.manager_name}] Исходящее клиенту {client_id} (время ответа: {response_time})")
 
         except Exception as e:
             logger.error(f"Ошибка анализа исходящего сообщения: {e}")
 
-    async def _detect_channel_source(self, event, history: list) -> Optional[str]:
-        """Определить источник клиента (канал)"""
+    async def detect_channel_source(self, message) -> Optional[str]:
+        """Определить источник клиента (канал) по сообщению"""
         try:
-            # Метод 1: Проверяем текст первого сообщения на упоминание канала
-            if event.message and event.message.text:
-                text = event.message.text.lower()
-                # Ищем упоминания каналов (@channel_name)
-                import re
-                channels = re.findall(r'@(\w+)', text)
-                if channels:
-                    return channels[0]
-
-            # Метод 2: Проверяем историю (если уже есть записи)
-            if history and len(history) > 0:
-                return history[0].get('channel_source')
-
-            # Метод 3: Можно расширить - проверять общие группы/каналы с клиентом
-            # Это требует дополнительных API вызовов
-
-            return 'unknown'
+            return attribution_engine.detect(message) or 'unknown'
 
         except Exception as e:
             logger.error(f"Ошибка определения канала: {e}")
@@ -0,0 +1,33 @@
+import asyncio
+import logging
+from aiohttp import web
+from config.settings import METRICS_LAG_INTERVAL
+from config.metrics import CONTENT_TYPE, registry, event_loop_lag_seconds
+
+logger = logging.getLogger(__name__)
+
+
+async def monitor_event_loop(interval: float = METRICS_LAG_INTERVAL):
+    """Замерять, насколько позже запланированного просыпается event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - expected))
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Поднять HTTP-эндпоинт /metrics"""
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return runner
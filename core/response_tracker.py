@@ -0,0 +1,81 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+from config.supabase import parse_time
+from config.settings import RESPONSE_PENDING_TTL_HOURS, RESPONSE_PENDING_MAX
+
+logger = logging.getLogger(__name__)
+
+
+class PendingResponseTracker:
+    """Клиенты, ожидающие ответа: client_id -> время последнего сообщения клиента"""
+
+    def __init__(self, ttl_hours: int = RESPONSE_PENDING_TTL_HOURS, max_entries: int = RESPONSE_PENDING_MAX):
+        self.ttl = timedelta(hours=ttl_hours)
+        self.max_entries = max_entries
+        # Порядок вставки = порядок времени, поэтому просроченные всегда в начале
+        self._pending: OrderedDict[int, datetime] = OrderedDict()
+
+        # Метрики
+        self.evicted_ttl = 0
+        self.evicted_overflow = 0
+        self.restored = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, client_id: int):
+        return client_id in self._pending
+
+    def mark(self, client_id: int, message_time: datetime):
+        """Клиент написал - ждем ответа менеджера"""
+        self._pending[client_id] = message_time
+        self._pending.move_to_end(client_id)
+
+        self.evict_expired(message_time)
+        while len(self._pending) > self.max_entries:
+            self._pending.popitem(last=False)
+            self.evicted_overflow += 1
+
+    def pop(self, client_id: int) -> Optional[datetime]:
+        """Менеджер ответил - убрать клиента из ожидания"""
+        return self._pending.pop(client_id, None)
+
+    def evict_expired(self, now: datetime = None) -> int:
+        """Удалить клиентов, которые ждут дольше TTL"""
+        cutoff = (now or datetime.now()) - self.ttl
+        evicted = 0
+        while self._pending:
+            client_id, message_time = next(iter(self._pending.items()))
+            if message_time >= cutoff:
+                break
+            del self._pending[client_id]
+            evicted += 1
+
+        self.evicted_ttl += evicted
+        return evicted
+
+    def restore(self, rows: list[dict]):
+        """Восстановить ожидания по недавним сообщениям из БД"""
+        events = sorted(
+            ((parse_time(row['message_time']), row) for row in rows),
+            key=lambda item: item[0]
+        )
+        for message_time, row in events:
+            if row['message_type'] == 'incoming':
+                self.mark(row['client_telegram_id'], message_time)
+            else:
+                self.pop(row['client_telegram_id'])
+
+        self.evict_expired()
+        self.restored = len(self._pending)
+
+    def get_stats(self) -> dict:
+        """Получить метрики трекера"""
+        return {
+            'size': len(self._pending),
+            'restored': self.restored,
+            'evicted_ttl': self.evicted_ttl,
+            'evicted_overflow': self.evicted_overflow,
+        }
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Optional
+from config.supabase import merge_hourly_rollup, replace_hourly_rollup, stream_rows, parse_time
+from config.settings import ROLLUP_FLUSH_INTERVAL
+from core.sketch import DistinctCounter
+from core.channel_cache import channel_source_cache
+
+logger = logging.getLogger(__name__)
+
+
+class HourlyRollupBucket:
+    """Приращения за час по паре менеджер × канал"""
+
+    def __init__(self):
+        self.messages_received = 0
+        self.messages_sent = 0
+        self.new_clients = 0
+        self.response_time_sum = 0.0
+        self.response_time_count = 0
+        self.clients = DistinctCounter()
+
+
+def _to_rows(buckets: dict[tuple[str, datetime, str], HourlyRollupBucket]) -> list[dict]:
+    """Строки telegram_hourly_rollup"""
+    return [
+        {
+            'manager_id': manager_id,
+            'hour': hour.isoformat(),
+            'channel_source': channel,
+            'messages_received': bucket.messages_received,
+            'messages_sent': bucket.messages_sent,
+            'new_clients': bucket.new_clients,
+            'response_time_sum': round(bucket.response_time_sum, 2),
+            'response_time_count': bucket.response_time_count,
+            'client_sketch': bucket.clients.to_dict(),
+        }
+        for (manager_id, hour, channel), bucket in buckets.items()
+    ]
+
+
+class HourlyRollup:
+    """Часовая свертка (менеджер × час × канал), которую пишет процесс приема событий.
+
+    Приращения живут в памяти до записи: при падении процесса теряется не больше
+    ROLLUP_FLUSH_INTERVAL, такие часы восстанавливает rebuild (scripts/rebuild_rollup.py)
+    при остановленном приеме.
+    """
+
+    def __init__(self, flush_interval: float = ROLLUP_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._buckets: dict[tuple[str, datetime, str], HourlyRollupBucket] = {}
+        # Неподтвержденная пачка (batch_id, строки): повторяется как есть, с тем же batch_id
+        self._unacked: Optional[tuple[str, list[dict]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.rows_flushed = 0
+        self.flush_errors = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def record(self, manager_id: str, message_time: datetime, client_id: int, message_type: str,
+               channel_source: Optional[str] = None, is_new: bool = False,
+               response_time_minutes: Optional[float] = None):
+        """Учесть обработанное сообщение"""
+        hour = message_time.replace(minute=0, second=0, microsecond=0)
+        key = (manager_id, hour, channel_source or 'unknown')
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = HourlyRollupBucket()
+
+        bucket.clients.add(client_id)
+        if message_type == 'outgoing':
+            bucket.messages_sent += 1
+            if response_time_minutes:
+                bucket.response_time_sum += float(response_time_minutes)
+                bucket.response_time_count += 1
+        else:
+            bucket.messages_received += 1
+            if is_new:
+                bucket.new_clients += 1
+
+    def start(self):
+        """Запустить фоновую запись свертки"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def flush(self) -> bool:
+        """Записать накопленные приращения (БД складывает их с уже записанными). False - БД недоступна"""
+        if self._unacked is None and self._buckets:
+            self._unacked = (uuid.uuid4().hex, _to_rows(self._buckets))
+            self._buckets = {}
+        if self._unacked is None:
+            return True
+
+        batch_id, rows = self._unacked
+        try:
+            applied = await merge_hourly_rollup(rows, batch_id)
+        except Exception as e:
+            # Ответ мог потеряться после записи в БД: повторяем ту же пачку, БД не применит ее дважды
+            self.flush_errors += 1
+            logger.error(f"Ошибка записи часовой свертки ({len(rows)} строк): {e}")
+            return False
+
+        self._unacked = None
+        if applied:
+            self.rows_flushed += len(rows)
+        else:
+            logger.info(f"🔁 Пачка свертки {batch_id} уже была записана - повтор пропущен")
+
+        # Накопленное за время неудачных попыток - следующей пачкой
+        return await self.flush() if self._buckets else True
+
+    async def stop(self):
+        """Остановить фоновую запись и записать остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        """Получить метрики свертки"""
+        return {
+            'pending_rows': len(self._buckets) + (len(self._unacked[1]) if self._unacked else 0),
+            'rows_flushed': self.rows_flushed,
+            'flush_errors': self.flush_errors,
+        }
+
+    async def _flush_loop(self):
+        """Периодическая запись свертки"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи свертки: {e}")
+
+
+async def rebuild(since: datetime, until: datetime) -> int:
+    """Пересчитать свертку за часы [since, until) из telegram_conversations и заменить ее в БД.
+
+    Только при остановленных процессах приема: их незаписанные приращения за эти часы
+    легли бы поверх пересчета.
+    """
+    since = since.replace(minute=0, second=0, microsecond=0)
+    # Текущий час еще пополняют живые процессы - его не трогаем
+    until = min(until, datetime.now().replace(minute=0, second=0, microsecond=0))
+    if since >= until:
+        return 0
+
+    rollup = HourlyRollup()
+    async for row in stream_rows(
+        'telegram_conversations',
+        'manager_id, client_telegram_id, message_time, message_type, is_new_client, '
+        'channel_source, response_time_minutes',
+        lambda q: q.gte('message_time', since.isoformat()).lt('message_time', until.isoformat()),
+        label='rebuild_hourly_rollup'
+    ):
+        channel_source = row.get('channel_source')
+        if row['message_type'] == 'outgoing':
+            # Как при живом приеме: канал первого контакта клиента
+            channel_source = await channel_source_cache.get(row['manager_id'], row['client_telegram_id'])
+        rollup.record(
+            row['manager_id'], parse_time(row['message_time']), row['client_telegram_id'], row['message_type'],
+            channel_source=channel_source, is_new=bool(row.get('is_new_client')),
+            response_time_minutes=row.get('response_time_minutes')
+        )
+
+    rows = _to_rows(rollup._buckets)
+    await replace_hourly_rollup(rows, since, until)
+    logger.info(f"🧮 Свертка за {since} - {until} перестроена: {len(rows)} строк")
+    return len(rows)
+
+
+# Общая свертка для всех userbot'ов процесса
+hourly_rollup = HourlyRollup()
@@ -0,0 +1,139 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from enum import IntEnum
+from telethon.errors import FloodWaitError
+from config.settings import TELEGRAM_RATE, TELEGRAM_BURST, TELEGRAM_FLOOD_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Приоритет запроса: меньше - важнее"""
+    LIVE = 0        # обработка живых событий и запуск
+    BACKGROUND = 1  # статусы, догрузка истории и прочие фоновые задачи
+
+
+class _AccountBucket:
+    """Token bucket и очередь ожидающих запросов одного аккаунта"""
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+        self.blocked_until = 0.0
+        self.waiters: list[tuple[int, int]] = []
+        self.condition = asyncio.Condition()
+
+        # Метрики
+        self.calls = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class TelegramRequestScheduler:
+    """Общий планировщик запросов к Telegram для всех userbot'ов (лимиты и FloodWait по аккаунтам)"""
+
+    def __init__(self, rate: float = TELEGRAM_RATE, burst: int = TELEGRAM_BURST,
+                 flood_retries: int = TELEGRAM_FLOOD_RETRIES):
+        self.rate = rate
+        self.burst = burst
+        self.flood_retries = flood_retries
+        self._accounts: dict[str, _AccountBucket] = {}
+        self._seq = itertools.count()
+
+    async def call(self, account_id: str, func, *args, priority: Priority = Priority.BACKGROUND, **kwargs):
+        """Выполнить запрос аккаунта с учетом лимита, приоритета и FloodWait"""
+        bucket = self._bucket(account_id)
+
+        for attempt in range(self.flood_retries + 1):
+            await self._acquire(bucket, priority)
+            try:
+                return await func(*args, **kwargs)
+            except FloodWaitError as e:
+                bucket.flood_waits += 1
+                bucket.flood_wait_seconds += e.seconds
+
+                # Блокируем аккаунт целиком: остальные запросы подождут в очереди
+                loop = asyncio.get_running_loop()
+                bucket.blocked_until = max(bucket.blocked_until, loop.time() + e.seconds)
+                logger.warning(f"⏳ FloodWait {e.seconds} с для {account_id} (попытка {attempt + 1})")
+
+                if attempt == self.flood_retries:
+                    raise
+
+    def get_stats(self) -> dict:
+        """Метрики очередей и ожиданий по аккаунтам"""
+        loop_time = asyncio.get_event_loop().time()
+        return {
+            account_id: {
+                'queued': len(bucket.waiters),
+                'calls': bucket.calls,
+                'tokens': round(bucket.tokens, 2),
+                'blocked_for': max(0.0, round(bucket.blocked_until - loop_time, 1)),
+                'flood_waits': bucket.flood_waits,
+                'flood_wait_seconds': bucket.flood_wait_seconds,
+                'avg_wait': round(bucket.wait_time / bucket.calls, 3) if bucket.calls else 0.0,
+                'max_wait': round(bucket.max_wait, 3),
+            }
+            for account_id, bucket in self._accounts.items()
+        }
+
+    def _bucket(self, account_id: str) -> _AccountBucket:
+        bucket = self._accounts.get(account_id)
+        if bucket is None:
+            now = asyncio.get_running_loop().time()
+            bucket = self._accounts[account_id] = _AccountBucket(self.rate, self.burst, now)
+        return bucket
+
+    async def _acquire(self, bucket: _AccountBucket, priority: Priority):
+        """Дождаться своей очереди (по приоритету) и свободного токена"""
+        loop = asyncio.get_running_loop()
+        entry = (int(priority), next(self._seq))
+        started = loop.time()
+
+        async with bucket.condition:
+            heapq.heappush(bucket.waiters, entry)
+            try:
+                while True:
+                    now = loop.time()
+                    bucket.refill(now)
+
+                    if bucket.waiters[0] == entry and now >= bucket.blocked_until and bucket.tokens >= 1:
+                        heapq.heappop(bucket.waiters)
+                        bucket.tokens -= 1
+                        bucket.condition.notify_all()
+                        break
+
+                    # Первый в очереди ждет токен или конец FloodWait, остальные - своей очереди
+                    timeout = None
+                    if bucket.waiters[0] == entry:
+                        timeout = max(bucket.blocked_until - now, (1 - bucket.tokens) / bucket.rate, 0.01)
+                    try:
+                        await asyncio.wait_for(bucket.condition.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                # Отмена: убираем себя из очереди и будим следующего
+                if entry in bucket.waiters:
+                    bucket.waiters.remove(entry)
+                    heapq.heapify(bucket.waiters)
+                    bucket.condition.notify_all()
+                raise
+
+        waited = loop.time() - started
+        bucket.calls += 1
+        bucket.wait_time += waited
+        bucket.max_wait = max(bucket.max_wait, waited)
+
+
+# Общий планировщик для всех userbot'ов процесса
+request_scheduler = TelegramRequestScheduler()
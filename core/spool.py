@@ -0,0 +1,82 @@
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationSpool:
+    """Локальный append-only журнал переписок (SQLite в режиме WAL)"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._db = sqlite3.connect(str(self.path), isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint ("
+            "name TEXT PRIMARY KEY, last_id INTEGER NOT NULL)"
+        )
+
+        self.checkpoint = self._load_checkpoint()
+        self._pending = self._db.execute(
+            "SELECT COUNT(*) FROM spool WHERE id > ?", (self.checkpoint,)
+        ).fetchone()[0]
+
+        if self._pending:
+            logger.info(f"📼 В журнале {self._pending} неотправленных строк, продолжаем с id={self.checkpoint}")
+
+    def __len__(self):
+        return self._pending
+
+    def append(self, rows: list[dict]):
+        """Дописать строки в журнал"""
+        self._db.executemany(
+            "INSERT INTO spool (payload) VALUES (?)",
+            [(json.dumps(row, ensure_ascii=False, default=str),) for row in rows]
+        )
+        self._pending += len(rows)
+
+    def peek(self, limit: int) -> tuple[int, list[dict]]:
+        """Прочитать следующую пачку после чекпоинта: (последний id, строки)"""
+        cursor = self._db.execute(
+            "SELECT id, payload FROM spool WHERE id > ? ORDER BY id LIMIT ?",
+            (self.checkpoint, limit)
+        )
+        records = cursor.fetchall()
+        if not records:
+            return self.checkpoint, []
+        return records[-1][0], [json.loads(payload) for _, payload in records]
+
+    def ack(self, last_id: int):
+        """Сдвинуть чекпоинт: всё до last_id включительно доставлено"""
+        shipped = self._db.execute(
+            "SELECT COUNT(*) FROM spool WHERE id > ? AND id <= ?", (self.checkpoint, last_id)
+        ).fetchone()[0]
+
+        self._db.execute("BEGIN")
+        self._db.execute(
+            "INSERT INTO checkpoint (name, last_id) VALUES ('shipper', ?) "
+            "ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id",
+            (last_id,)
+        )
+        self._db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+        self._db.execute("COMMIT")
+
+        self.checkpoint = last_id
+        self._pending -= shipped
+
+    def close(self):
+        """Закрыть журнал"""
+        self._db.close()
+
+    def _load_checkpoint(self) -> int:
+        row = self._db.execute("SELECT last_id FROM checkpoint WHERE name = 'shipper'").fetchone()
+        return row[0] if row else 0
@@ -1,10 +1,23 @@
+import asyncio
 import logging
 from datetime import datetime, date, timedelta
 from typing import Dict, List
-from config.supabase import supabase, save_daily_stats
+from config.supabase import stream_rows, save_daily_stats, upsert_daily_stats, save_manager_metrics
+from core.aggregator import DailyStatsBucket, daily_stats_aggregator
+from core.histogram import ResponseTimeHistogram
+from core.sketch import DistinctCounter
+from core import stats_engine
+from core.stats_engine import ConversationFrame
+from core.stats_cache import closed_day_cache
 
 logger = logging.getLogger(__name__)
 
+# Колонки, которых достаточно для дневной статистики
+STATS_COLUMNS = (
+    'manager_id, client_telegram_id, message_type, is_new_client, response_time_minutes, '
+    'chat_id, telegram_message_id'
+)
+
 class StatisticsCalculator:
     """Расчет статистики по переписках"""
 
@@ -15,72 +28,41 @@ class StatisticsCalculator:
             if target_date is None:
                 target_date = date.today()
 
+            # Прошедший день, уже посчитанный окончательно, - из кэша
+            cached = await closed_day_cache.get_many([manager_id], target_date, target_date)
+            if cached:
+                return cached[(manager_id, target_date)]
+
+            # Поколение дня до чтения: поздние сообщения во время пересчета не дадут его закрыть
+            generations = closed_day_cache.generations([manager_id], target_date)
+
             # Получаем все переписки за день
             start_time = datetime.combine(target_date, datetime.min.time()).isoformat()
             end_time = datetime.combine(target_date, datetime.max.time()).isoformat()
 
-            result = supabase.table('telegram_conversations').select('*').eq(
-                'manager_id', manager_id
-            ).gte('message_time', start_time).lte('message_time', end_time).execute()
-
-            conversations = result.data
-
-            if not conversations:
-                return {
-                    'manager_id': manager_id,
-                    'date': target_date.isoformat(),
-                    'new_clients': 0,
-                    'returning_clients': 0,
-                    'total_conversations': 0,
-                    'messages_sent': 0,
-                    'messages_received': 0,
-                    'avg_response_time_minutes': None
-                }
+            conversations = stream_rows(
+                'telegram_conversations', STATS_COLUMNS,
+                lambda q: q.eq('manager_id', manager_id).gte(
+                    'message_time', start_time
+                ).lte('message_time', end_time),
+                label='daily_stats'
+            )
 
             # Подсчет метрик
-            new_clients = set()
-            returning_clients = set()
-            messages_sent = 0
-            messages_received = 0
-            response_times = []
-
-            for conv in conversations:
-                client_id = conv['client_telegram_id']
-
-                # Определяем новых/повторных клиентов
-                if conv.get('is_new_client'):
-                    new_clients.add(client_id)
-                else:
-                    returning_clients.add(client_id)
-
-                # Считаем сообщения
-                if conv['message_type'] == 'outgoing':
-                    messages_sent += 1
-
-                    # Собираем время ответа
-                    if conv.get('response_time_minutes'):
-                        response_times.append(conv['response_time_minutes'])
-                else:
-                    messages_received += 1
-
-            # Рассчитываем среднее время ответа
-            avg_response_time = None
-            if response_times:
-                avg_response_time = sum(response_times) / len(response_times)
+            bucket = DailyStatsBucket()
+            async for conv in conversations:
+                bucket.add_row(conv)
 
-            stats = {
-                'manager_id': manager_id,
-                'date': target_date.isoformat(),
-                'new_clients': len(new_clients),
-                'returning_clients': len(returning_clients),
-                'total_conversations': len(new_clients) + len(returning_clients),
-                'messages_sent': messages_sent,
-                'messages_received': messages_received,
-                'avg_response_time_minutes': round(avg_response_time, 1) if avg_response_time else None
-            }
+            # Полный пересчет заменяет инкрементальные счетчики (сверка);
+            # события, еще не записанные в БД, добавляются к нему
+            daily_stats_aggregator.seed(manager_id, target_date, bucket)
+            stats = bucket.to_stats(manager_id, target_date)
 
-            # Сохраняем в базу
-            await save_daily_stats(stats)
+            # Сохраняем в базу (прошедший день - сразу закрытым)
+            if target_date < date.today():
+                await closed_day_cache.store([stats], generations)
+            else:
+                await save_daily_stats(stats)
 
             logger.info(f"📊 Статистика за {target_date} для {manager_id}: "
                        f"новых={stats['new_clients']}, повторных={stats['returning_clients']}")
@@ -92,17 +74,143 @@ class StatisticsCalculator:
             return {}
 
     @staticmethod
-    async def calculate_weekly_stats(manager_id: str) -> Dict:
-        """Рассчитать статистику за неделю"""
+    async def calculate_all_daily_stats(manager_ids: List[str], target_date: date = None) -> List[Dict]:
+        """Рассчитать статистику за день сразу для всех менеджеров (один проход, одна запись)"""
         try:
-            end_date = date.today()
-            start_date = end_date - timedelta(days=7)
+            if target_date is None:
+                target_date = date.today()
+
+            # Прошедший день пересчитываем только для менеджеров без закрытой статистики
+            cached = await closed_day_cache.get_many(manager_ids, target_date, target_date)
+            manager_ids = [m for m in manager_ids if (m, target_date) not in cached]
+            if not manager_ids:
+                return list(cached.values())
+
+            generations = closed_day_cache.generations(manager_ids, target_date)
+            start_time = datetime.combine(target_date, datetime.min.time()).isoformat()
+            end_time = datetime.combine(target_date, datetime.max.time()).isoformat()
 
-            result = supabase.table('telegram_daily_stats').select('*').eq(
-                'manager_id', manager_id
-            ).gte('date', start_date.isoformat()).lte('date', end_date.isoformat()).execute()
+            # Только нужные колонки, все менеджеры одним потоком
+            conversations = stream_rows(
+                'telegram_conversations', STATS_COLUMNS,
+                lambda q: q.in_('manager_id', manager_ids).gte(
+                    'message_time', start_time
+                ).lte('message_time', end_time),
+                label='daily_stats'
+            )
+
+            buckets = {manager_id: DailyStatsBucket() for manager_id in manager_ids}
+            messages = 0
+            async for conv in conversations:
+                buckets[conv['manager_id']].add_row(conv)
+                messages += 1
+
+            all_stats = []
+            for manager_id, bucket in buckets.items():
+                daily_stats_aggregator.seed(manager_id, target_date, bucket)
+                all_stats.append(bucket.to_stats(manager_id, target_date))
+
+            # Одна запись upsert на всех (прошедший день - сразу закрытым)
+            if target_date < date.today():
+                await closed_day_cache.store(all_stats, generations)
+            else:
+                await upsert_daily_stats(all_stats)
+
+            logger.info(f"📊 Статистика за {target_date} для {len(all_stats)} менеджеров "
+                        f"({messages} сообщений)")
+
+            return list(cached.values()) + all_stats
 
-            daily_stats = result.data
+        except Exception as e:
+            logger.error(f"Ошибка расчета статистики: {e}")
+            return []
+
+    @staticmethod
+    async def get_daily_stats_range(manager_ids: List[str], start_date: date, end_date: date) -> List[Dict]:
+        """Дневная статистика за диапазон: закрытые дни - из кэша, сегодня - из агрегатора, недостающее - одним проходом"""
+        try:
+            cached = await closed_day_cache.get_many(manager_ids, start_date, end_date)
+            all_stats = list(cached.values())
+
+            # Сегодня - из инкрементального агрегатора, без пересева и записи
+            today = date.today()
+            missing = []
+            if start_date <= today <= end_date:
+                for manager_id in manager_ids:
+                    stats = daily_stats_aggregator.snapshot(manager_id, today)
+                    if stats is None:
+                        missing.append((manager_id, today))
+                    else:
+                        all_stats.append(stats)
+
+            day = start_date
+            while day <= min(end_date, today - timedelta(days=1)):
+                missing.extend((m, day) for m in manager_ids if (m, day) not in cached)
+                day += timedelta(days=1)
+            if not missing:
+                return all_stats
+
+            # Поколения дней до чтения: поздние сообщения во время пересчета не дадут их закрыть
+            days = sorted({d for _, d in missing})
+            generations = {}
+            for day in days:
+                generations.update(closed_day_cache.generations(manager_ids, day))
+
+            start_time = datetime.combine(days[0], datetime.min.time()).isoformat()
+            end_time = datetime.combine(days[-1], datetime.max.time()).isoformat()
+            missing_managers = sorted({m for m, _ in missing})
+
+            # Все недостающие дни одним потоком, с разбивкой по (менеджер, день)
+            conversations = stream_rows(
+                'telegram_conversations', STATS_COLUMNS,
+                lambda q: q.in_('manager_id', missing_managers).gte(
+                    'message_time', start_time
+                ).lte('message_time', end_time),
+                label='daily_stats_range'
+            )
+
+            buckets = {key: DailyStatsBucket() for key in missing}
+            async for conv in conversations:
+                bucket = buckets.get((conv['manager_id'], date.fromisoformat(conv['message_time'][:10])))
+                if bucket is not None:
+                    bucket.add_row(conv)
+
+            computed = [bucket.to_stats(manager_id, day) for (manager_id, day), bucket in buckets.items()]
+            all_stats.extend(computed)
+
+            # Прошедшие дни закрываются (их берет кэш), сегодняшний - только в отчет
+            closed = [stats for stats in computed if date.fromisoformat(stats['date']) < today]
+            if closed:
+                await closed_day_cache.store(closed, generations)
+
+            logger.info(f"📊 Статистика за {start_date} - {end_date}: пересчитано {len(computed)} "
+                        f"дней менеджеров одним проходом")
+            return all_stats
+
+        except Exception as e:
+            logger.error(f"Ошибка расчета статистики за период: {e}")
+            return []
+
+    @staticmethod
+    async def persist_incremental_stats() -> int:
+        """Сохранить изменившиеся дни из инкрементального агрегатора"""
+        all_stats = daily_stats_aggregator.pop_dirty()
+        if not all_stats:
+            return 0
+
+        if await upsert_daily_stats(all_stats) is None:
+            for stats in all_stats:
+                daily_stats_aggregator.mark_dirty(stats['manager_id'], date.fromisoformat(stats['date']))
+            return 0
+
+        return len(all_stats)
+
+    @staticmethod
+    async def calculate_period_stats(manager_id: str, start_date: date, end_date: date,
+                                     manager_name: str = None) -> Dict:
+        """Рассчитать статистику за период слиянием дневных гистограмм"""
+        try:
+            daily_stats = await StatisticsCalculator.get_daily_stats_range([manager_id], start_date, end_date)
 
             if not daily_stats:
                 return {}
@@ -113,26 +221,62 @@ class StatisticsCalculator:
             total_messages_sent = sum(s.get('messages_sent', 0) for s in daily_stats)
             total_messages_received = sum(s.get('messages_received', 0) for s in daily_stats)
 
-            # Среднее время ответа
-            response_times = [s.get('avg_response_time_minutes') for s in daily_stats
-                            if s.get('avg_response_time_minutes') is not None]
-            avg_response = sum(response_times) / len(response_times) if response_times else None
+            # Время ответа: сливаем гистограммы, а не усредняем средние
+            histogram = ResponseTimeHistogram()
+            for s in daily_stats:
+                histogram.merge(ResponseTimeHistogram.from_dict(s.get('response_time_histogram')))
 
-            return {
+            def minutes(seconds):
+                return round(seconds / 60, 1) if seconds is not None else None
+
+            stats = {
                 'manager_id': manager_id,
                 'period': f"{start_date} - {end_date}",
                 'total_new_clients': total_new,
                 'total_returning_clients': total_returning,
                 'total_messages_sent': total_messages_sent,
                 'total_messages_received': total_messages_received,
-                'avg_response_time_minutes': round(avg_response, 1) if avg_response else None,
-                'days_active': len(daily_stats)
+                'avg_response_time_minutes': minutes(histogram.mean()),
+                'p50_response_time_minutes': minutes(histogram.quantile(0.5)),
+                'p90_response_time_minutes': minutes(histogram.quantile(0.9)),
+                'p99_response_time_minutes': minutes(histogram.quantile(0.99)),
+                'fastest_response_seconds': int(histogram.min) if histogram.min is not None else None,
+                'slowest_response_minutes': int(histogram.max // 60) if histogram.max is not None else None,
+                'days_active': sum(
+                    1 for s in daily_stats if s.get('messages_sent', 0) or s.get('messages_received', 0)
+                )
             }
 
+            # Сохраняем в метрики менеджера
+            if manager_name:
+                await save_manager_metrics({
+                    'manager_id': manager_id,
+                    'manager_name': manager_name,
+                    'period_start': start_date.isoformat(),
+                    'period_end': end_date.isoformat(),
+                    'total_new_clients': total_new,
+                    'total_returning_clients': total_returning,
+                    'total_messages_sent': total_messages_sent,
+                    'total_messages_received': total_messages_received,
+                    'avg_response_time_minutes': stats['avg_response_time_minutes'],
+                    'fastest_response_seconds': stats['fastest_response_seconds'],
+                    'slowest_response_minutes': stats['slowest_response_minutes'],
+                    'response_time_histogram': histogram.to_dict() if histogram.count else None
+                })
+
+            return stats
+
         except Exception as e:
-            logger.error(f"Ошибка расчета недельной статистики: {e}")
+            logger.error(f"Ошибка расчета статистики за период: {e}")
             return {}
 
+    @staticmethod
+    async def calculate_weekly_stats(manager_id: str, manager_name: str = None) -> Dict:
+        """Рассчитать статистику за неделю"""
+        end_date = date.today()
+        start_date = end_date - timedelta(days=7)
+        return await StatisticsCalculator.calculate_period_stats(manager_id, start_date, end_date, manager_name)
+
     @staticmethod
     async def get_channel_stats(target_date: date = None) -> List[Dict]:
         """Получить статистику по каналам"""
@@ -140,43 +284,121 @@ class StatisticsCalculator:
             if target_date is None:
                 target_date = date.today()
 
-            start_time = datetime.combine(target_date, datetime.min.time()).isoformat()
-            end_time = datetime.combine(target_date, datetime.max.time()).isoformat()
+            start = datetime.combine(target_date, datetime.min.time())
+            frame = await ConversationFrame.load(
+                start, start + timedelta(days=1), apply_filters=lambda q: q.eq('is_new_client', True)
+            )
 
-            result = supabase.table('telegram_conversations').select('*').gte(
-                'message_time', start_time
-            ).lte('message_time', end_time).eq('is_new_client', True).execute()
+            result = [
+                {'channel': row['channel'], 'new_clients': row['new_clients'], 'managers_count': row['managers_count']}
+                for row in await asyncio.to_thread(stats_engine.channel_day_report, frame)
+            ]
 
-            conversations = result.data
+            # Сортируем по количеству клиентов
+            result.sort(key=lambda x: x['new_clients'], reverse=True)
+
+            return result
 
-            # Группируем по каналам
-            channel_stats = {}
-            for conv in conversations:
-                channel = conv.get('channel_source', 'unknown')
-                if channel not in channel_stats:
-                    channel_stats[channel] = {
-                        'channel': channel,
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики каналов: {e}")
+            return []
+
+    @staticmethod
+    async def calculate_range_report(start: datetime, end: datetime, manager_ids: List[str] = None) -> Dict:
+        """Отчет за произвольный диапазон: итоги по менеджерам, менеджер × день и канал × день"""
+        try:
+            frame = await ConversationFrame.load(start, end, manager_ids)
+
+            def build():
+                return {
+                    'period': f"{start.date()} - {(end - timedelta(seconds=1)).date()}",
+                    'messages': len(frame),
+                    'managers': stats_engine.manager_totals_report(frame),
+                    'daily': stats_engine.manager_day_report(frame),
+                    'channels': stats_engine.channel_day_report(frame),
+                }
+
+            return await asyncio.to_thread(build)
+
+        except Exception as e:
+            logger.error(f"Ошибка расчета отчета за диапазон: {e}")
+            return {}
+
+    @staticmethod
+    async def calculate_monthly_stats(year: int, month: int, manager_ids: List[str] = None) -> Dict:
+        """Отчет за календарный месяц (рейтинг менеджеров - по новым клиентам)"""
+        start, end = stats_engine.month_range(year, month)
+        return await StatisticsCalculator.calculate_range_report(start, end, manager_ids)
+
+    @staticmethod
+    async def get_load_heatmap(start: datetime, end: datetime, manager_ids: List[str] = None) -> Dict:
+        """Тепловые карты нагрузки: менеджер × час суток и день недели × час суток"""
+        try:
+            frame = await ConversationFrame.load(start, end, manager_ids)
+
+            def build():
+                return {
+                    'by_manager': stats_engine.hour_heatmap(frame),
+                    'by_weekday': stats_engine.weekday_heatmap(frame),
+                }
+
+            return await asyncio.to_thread(build)
+
+        except Exception as e:
+            logger.error(f"Ошибка построения тепловой карты нагрузки: {e}")
+            return {}
+
+    @staticmethod
+    async def get_rollup_stats(start_time: datetime, end_time: datetime,
+                               group_by: str = 'manager_id', manager_id: str = None) -> List[Dict]:
+        """Статистика за произвольный диапазон по часовой свертке (group_by: manager_id или channel_source)"""
+        try:
+            def apply_filters(q):
+                q = q.gte('hour', start_time.isoformat()).lt('hour', end_time.isoformat())
+                return q.eq('manager_id', manager_id) if manager_id else q
+
+            rows = stream_rows(
+                'telegram_hourly_rollup',
+                'manager_id, channel_source, messages_received, messages_sent, new_clients, '
+                'response_time_sum, response_time_count, client_sketch',
+                apply_filters,
+                time_column='hour',
+                label='hourly_rollup_range'
+            )
+
+            groups = {}
+            async for row in rows:
+                key = row[group_by]
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = {
+                        group_by: key,
                         'new_clients': 0,
-                        'managers': set()
+                        'messages_sent': 0,
+                        'messages_received': 0,
+                        'response_time_sum': 0.0,
+                        'response_time_count': 0,
+                        'clients': DistinctCounter()
                     }
 
-                channel_stats[channel]['new_clients'] += 1
-                channel_stats[channel]['managers'].add(conv['manager_id'])
+                group['new_clients'] += row['new_clients']
+                group['messages_sent'] += row['messages_sent']
+                group['messages_received'] += row['messages_received']
+                group['response_time_sum'] += float(row['response_time_sum'] or 0)
+                group['response_time_count'] += row['response_time_count']
+                group['clients'].merge(DistinctCounter.from_dict(row['client_sketch']))
 
-            # Конвертируем в список
             result = []
-            for channel, stats in channel_stats.items():
-                result.append({
-                    'channel': channel,
-                    'new_clients': stats['new_clients'],
-                    'managers_count': len(stats['managers'])
-                })
+            for group in groups.values():
+                count = group.pop('response_time_count')
+                total = group.pop('response_time_sum')
+                group['unique_clients'] = group.pop('clients').estimate()
+                group['avg_response_time_minutes'] = round(total / count, 1) if count else None
+                result.append(group)
 
-            # Сортируем по количеству клиентов
             result.sort(key=lambda x: x['new_clients'], reverse=True)
-
             return result
 
         except Exception as e:
-            logger.error(f"Ошибка получения статистики каналов: {e}")
+            logger.error(f"Ошибка получения статистики по свертке: {e}")
             return []
@@ -0,0 +1,118 @@
+import logging
+from datetime import date
+from config.supabase import get_closed_daily_stats, reopen_daily_stats, upsert_daily_stats
+
+logger = logging.getLogger(__name__)
+
+
+class ClosedDayStatsCache:
+    """Кэш статистики прошедших дней (в памяти и в telegram_daily_stats с is_closed)"""
+
+    def __init__(self):
+        self._stats: dict[tuple[str, date], dict] = {}
+        # Поколение дня растет при каждом сбросе: пересчет, начатый до сброса, день не закрывает
+        self._generations: dict[tuple[str, date], int] = {}
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._stats)
+
+    async def get_many(self, manager_ids: list[str], start_date: date, end_date: date) -> dict[tuple[str, date], dict]:
+        """Закрытые дни из диапазона: сначала память, недостающее - одним запросом к БД"""
+        end_date = min(end_date, date.fromordinal(date.today().toordinal() - 1))
+        if start_date > end_date or not manager_ids:
+            return {}
+
+        days = [date.fromordinal(d) for d in range(start_date.toordinal(), end_date.toordinal() + 1)]
+        found = {
+            (m, d): self._stats[(m, d)]
+            for m in manager_ids for d in days if (m, d) in self._stats
+        }
+
+        if len(found) < len(manager_ids) * len(days):
+            for row in await get_closed_daily_stats(manager_ids, start_date, end_date):
+                key = (row['manager_id'], date.fromisoformat(row['date']))
+                self._stats[key] = found[key] = row
+
+        wanted = len(manager_ids) * len(days)
+        self.hits += len(found)
+        self.misses += wanted - len(found)
+        return found
+
+    def generations(self, manager_ids: list[str], day: date) -> dict[tuple[str, date], int]:
+        """Снять поколения дней перед пересчетом (передаются в store)"""
+        return {(m, day): self._generations.get((m, day), 0) for m in manager_ids}
+
+    async def store(self, all_stats: list[dict], generations: dict[tuple[str, date], int]) -> bool:
+        """Закрыть посчитанные прошедшие дни (сегодняшний день и сброшенные во время пересчета - не закрываются)"""
+        today = date.today()
+        rows = []
+        for stats in all_stats:
+            key = (stats['manager_id'], date.fromisoformat(stats['date']))
+            # Поздние сообщения пришли во время пересчета - день остается открытым
+            stale = self._generations.get(key, 0) != generations.get(key, 0)
+            rows.append({**stats, 'is_closed': key[1] < today and not stale})
+        if not rows:
+            return True
+
+        if await upsert_daily_stats(rows) is None:
+            return False
+
+        reopened: dict[str, list[date]] = {}
+        for stats in rows:
+            if not stats['is_closed']:
+                continue
+            key = (stats['manager_id'], date.fromisoformat(stats['date']))
+            if self._generations.get(key, 0) == generations.get(key, 0):
+                self._stats[key] = stats
+            else:
+                # Сброс случился во время самой записи - его reopen мог выполниться раньше нее
+                reopened.setdefault(key[0], []).append(key[1])
+
+        for manager_id, dates in reopened.items():
+            try:
+                await reopen_daily_stats(manager_id, dates)
+            except Exception as e:
+                logger.error(f"Ошибка сброса закрытых дней {manager_id}: {e}")
+        return True
+
+    async def invalidate_rows(self, rows: list[dict]):
+        """Открыть дни, в которые записаны поздние сообщения (догрузка, повтор из журнала)"""
+        today = date.today().isoformat()
+        late: dict[str, set[date]] = {}
+        for row in rows:
+            day = row['message_time'][:10]
+            if day < today:
+                late.setdefault(row['manager_id'], set()).add(date.fromisoformat(day))
+
+        # Все дни сбрасываются в памяти до первого await: пересчет, идущий параллельно, их уже не закроет
+        for manager_id, dates in late.items():
+            for day in dates:
+                self._stats.pop((manager_id, day), None)
+                self._generations[(manager_id, day)] = self._generations.get((manager_id, day), 0) + 1
+
+        for manager_id, dates in late.items():
+            try:
+                await reopen_daily_stats(manager_id, sorted(dates))
+                self.invalidations += len(dates)
+                logger.info(f"♻️ Поздние сообщения {manager_id} за {', '.join(map(str, sorted(dates)))} "
+                            f"- дни будут пересчитаны")
+            except Exception as e:
+                logger.error(f"Ошибка сброса закрытых дней {manager_id}: {e}")
+
+    def get_stats(self) -> dict:
+        """Получить метрики кэша"""
+        return {
+            'cached_days': len(self._stats),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+
+# Общий кэш для всех userbot'ов процесса
+closed_day_cache = ClosedDayStatsCache()
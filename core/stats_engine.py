@@ -0,0 +1,249 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+import numpy as np
+from config.supabase import stream_rows
+
+logger = logging.getLogger(__name__)
+
+# Колонки, которые загружает движок
+FRAME_COLUMNS = (
+    'manager_id, client_telegram_id, message_time, message_type, '
+    'is_new_client, channel_source, response_time_minutes'
+)
+
+# Квантили времени ответа в отчетах
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _factorize(values: list) -> tuple[np.ndarray, list]:
+    """Значения -> (коды int32, словарь кодов)"""
+    labels, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    return codes.astype(np.int32), labels.tolist()
+
+
+def _group_quantiles(groups: np.ndarray, values: np.ndarray, n_groups: int,
+                     quantiles: tuple) -> np.ndarray:
+    """Квантили values внутри каждой группы (линейная интерполяция, как numpy.quantile); NaN - пропуск"""
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = np.full((n_groups, len(quantiles)), np.nan)
+    filled = counts > 0
+    for i, q in enumerate(quantiles):
+        position = starts[filled] + q * (counts[filled] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position - lower
+        result[filled, i] = values[lower] * (1 - fraction) + values[upper] * fraction
+    return result
+
+
+def _distinct_per_group(groups: np.ndarray, clients: np.ndarray, n_groups: int) -> np.ndarray:
+    """Число уникальных клиентов в каждой группе"""
+    if not len(groups):
+        return np.zeros(n_groups, dtype=np.int64)
+    pairs = np.unique(np.stack((groups.astype(np.int64), clients)), axis=1)
+    return np.bincount(pairs[0], minlength=n_groups)
+
+
+def _round(value, digits: int = 1):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+class ConversationFrame:
+    """Переписки в виде типизированных колонок NumPy (группировки без циклов по строкам)"""
+
+    def __init__(self, rows: Iterable[dict], start: Optional[date] = None):
+        managers, channels, clients, times = [], [], [], []
+        incoming, new, response = [], [], []
+
+        for row in rows:
+            managers.append(row['manager_id'])
+            channels.append(row.get('channel_source') or 'unknown')
+            clients.append(row['client_telegram_id'])
+            # Первые 19 символов ISO - локальное время без смещения и долей секунды
+            times.append(row['message_time'][:19])
+            incoming.append(row['message_type'] == 'incoming')
+            new.append(bool(row.get('is_new_client')))
+            rt = row.get('response_time_minutes')
+            response.append(float(rt) if rt else np.nan)
+
+        self.size = len(managers)
+        self.manager, self.managers = _factorize(managers)
+        self.channel, self.channels = _factorize(channels)
+        self.client = np.array(clients, dtype=np.int64)
+        self.time = np.array(times, dtype='datetime64[s]')
+        self.incoming = np.array(incoming, dtype=bool)
+        self.new = np.array(new, dtype=bool)
+        self.response = np.array(response, dtype=np.float64)
+
+        # Календарные признаки
+        day = self.time.astype('datetime64[D]')
+        self.start = np.datetime64(start, 'D') if start else (day.min() if self.size else np.datetime64('today', 'D'))
+        self.day = (day - self.start).astype(np.int64)
+        self.n_days = int(self.day.max()) + 1 if self.size else 0
+        self.hour = ((self.time - day) // np.timedelta64(1, 'h')).astype(np.int64)
+        self.weekday = (day.astype(np.int64) + 3) % 7  # 0 - понедельник (1970-01-01 - четверг)
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    async def load(cls, start: datetime, end: datetime, manager_ids: Optional[list[str]] = None,
+                   apply_filters=None) -> 'ConversationFrame':
+        """Загрузить переписки за [start, end) потоком из Supabase"""
+        def filters(q):
+            q = q.gte('message_time', start.isoformat()).lt('message_time', end.isoformat())
+            if manager_ids:
+                q = q.in_('manager_id', manager_ids)
+            return apply_filters(q) if apply_filters else q
+
+        rows = [row async for row in stream_rows('telegram_conversations', FRAME_COLUMNS, filters, label='stats_frame')]
+        # Разбор строк в колонки - вне event loop
+        return await asyncio.to_thread(cls, rows, start.date())
+
+    def date_of(self, day_index: int) -> date:
+        return (self.start + np.timedelta64(int(day_index), 'D')).item()
+
+    def summary(self, keys: tuple[np.ndarray, ...], sizes: tuple[int, ...],
+                quantiles: tuple = DEFAULT_QUANTILES) -> dict[str, np.ndarray]:
+        """Метрики по группам декартова произведения ключей (массивы формы sizes)"""
+        group = np.zeros(self.size, dtype=np.int64)
+        for key, size in zip(keys, sizes):
+            group = group * size + key
+        n_groups = int(np.prod(sizes))
+
+        received = np.bincount(group, weights=self.incoming, minlength=n_groups)
+        new_clients = _distinct_per_group(group[self.new & self.incoming], self.client[self.new & self.incoming], n_groups)
+        unique_clients = _distinct_per_group(group, self.client, n_groups)
+
+        answered = ~np.isnan(self.response)
+        rt_count = np.bincount(group[answered], minlength=n_groups)
+        rt_sum = np.bincount(group[answered], weights=self.response[answered], minlength=n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rt_mean = np.where(rt_count > 0, rt_sum / np.maximum(rt_count, 1), np.nan)
+
+        result = {
+            'messages_received': received.astype(np.int64),
+            'messages_sent': (np.bincount(group, minlength=n_groups) - received).astype(np.int64),
+            'new_clients': new_clients,
+            'unique_clients': unique_clients,
+            'avg_response_time': rt_mean,
+        }
+        q_values = _group_quantiles(group, self.response, n_groups, quantiles)
+        for i, q in enumerate(quantiles):
+            result[f'p{int(q * 100)}_response_time'] = q_values[:, i]
+
+        return {name: values.reshape(sizes) for name, values in result.items()}
+
+
+def _records(summary: dict[str, np.ndarray], index: tuple, labels: dict) -> dict:
+    """Строка отчета из ячейки массивов summary"""
+    record = dict(labels)
+    for name, values in summary.items():
+        value = values[index]
+        record[name] = _round(value) if values.dtype.kind == 'f' else int(value)
+    return record
+
+
+def manager_day_report(frame: ConversationFrame) -> list[dict]:
+    """Менеджер × день"""
+    if not len(frame):
+        return []
+    sizes = (len(frame.managers), frame.n_days)
+    summary = frame.summary((frame.manager, frame.day), sizes)
+    active = (summary['messages_received'] + summary['messages_sent']) > 0
+
+    return [
+        _records(summary, (m, d), {'manager_id': frame.managers[m], 'date': frame.date_of(d).isoformat()})
+        for m, d in zip(*np.nonzero(active))
+    ]
+
+
+def manager_totals_report(frame: ConversationFrame) -> list[dict]:
+    """Итоги по менеджерам за весь диапазон (с уникальными клиентами и квантилями за период)"""
+    if not len(frame):
+        return []
+    summary = frame.summary((frame.manager,), (len(frame.managers),))
+    active_days = _distinct_per_group(frame.manager, frame.day, len(frame.managers))
+
+    report = [
+        {**_records(summary, (m,), {'manager_id': manager}), 'days_active': int(active_days[m])}
+        for m, manager in enumerate(frame.managers)
+    ]
+    report.sort(key=lambda x: x['new_clients'], reverse=True)
+    return report
+
+
+def channel_day_report(frame: ConversationFrame) -> list[dict]:
+    """Канал × день: новые клиенты и число менеджеров, к которым они пришли"""
+    if not len(frame):
+        return []
+    sizes = (len(frame.channels), frame.n_days)
+    summary = frame.summary((frame.channel, frame.day), sizes)
+
+    n_groups = int(np.prod(sizes))
+    group = frame.channel.astype(np.int64) * frame.n_days + frame.day
+    first_contact = frame.new & frame.incoming
+    managers = _distinct_per_group(group[first_contact], frame.manager[first_contact].astype(np.int64), n_groups)
+    managers = managers.reshape(sizes)
+
+    return [
+        {
+            'channel': frame.channels[c],
+            'date': frame.date_of(d).isoformat(),
+            'new_clients': int(summary['new_clients'][c, d]),
+            'unique_clients': int(summary['unique_clients'][c, d]),
+            'messages_received': int(summary['messages_received'][c, d]),
+            'managers_count': int(managers[c, d]),
+        }
+        for c, d in zip(*np.nonzero(summary['messages_received'] > 0))
+    ]
+
+
+def hour_heatmap(frame: ConversationFrame) -> dict:
+    """Нагрузка менеджер × час суток: входящие, исходящие и среднее время ответа"""
+    sizes = (len(frame.managers), 24)
+    summary = frame.summary((frame.manager, frame.hour), sizes, quantiles=(0.5,))
+    return {
+        'managers': frame.managers,
+        'hours': list(range(24)),
+        'messages_received': summary['messages_received'].tolist(),
+        'messages_sent': summary['messages_sent'].tolist(),
+        'avg_response_time': [[_round(v) for v in row] for row in summary['avg_response_time']],
+    }
+
+
+def weekday_heatmap(frame: ConversationFrame) -> dict:
+    """Нагрузка всей команды день недели × час суток (входящие)"""
+    received = np.bincount(
+        frame.weekday[frame.incoming] * 24 + frame.hour[frame.incoming], minlength=7 * 24
+    ).reshape(7, 24)
+    return {
+        'weekdays': ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс'],
+        'hours': list(range(24)),
+        'messages_received': received.tolist(),
+    }
+
+
+def response_quantiles(frame: ConversationFrame, quantiles: tuple = DEFAULT_QUANTILES) -> dict[str, dict]:
+    """Квантили времени ответа (минуты) по менеджерам"""
+    values = _group_quantiles(frame.manager, frame.response, len(frame.managers), quantiles)
+    return {
+        manager: {f'p{int(q * 100)}': _round(values[m, i]) for i, q in enumerate(quantiles)}
+        for m, manager in enumerate(frame.managers)
+    }
+
+
+def month_range(year: int, month: int) -> tuple[datetime, datetime]:
+    """Границы календарного месяца [start, end)"""
+    start = datetime(year, month, 1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
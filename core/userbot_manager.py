@@ -1,28 +1,54 @@
 import logging
 import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional
 from pathlib import Path
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 from core.message_analyzer import MessageAnalyzer
-from config.settings import DATA_DIR
+from core.batch_writer import conversation_writer
+from core.client_index import last_seen_index
+from core.dedup import recent_messages
+from core.rollup import hourly_rollup
+from core.local_store import local_store
+from core.attribution import attribution_engine
+from core.scheduler import request_scheduler, Priority
+from core.activity import ActivityTracker
+from config.metrics import events_total, handler_seconds
+from config.supabase import get_recent_activity
+from config.settings import (
+    DATA_DIR, NEW_CLIENT_HOURS, RESPONSE_PENDING_TTL_HOURS, DIALOGS_REFRESH_INTERVAL, STARTUP_CONCURRENCY,
+    CLIENT_INDEX_DIR
+)
 
 logger = logging.getLogger(__name__)
 
+# Этапы запуска userbot'а для сводки (ready - от начала запуска до регистрации обработчиков)
+STARTUP_STAGES = {
+    'connect': "подключение",
+    'authorize': "авторизация",
+    'ready': "прием сообщений",
+    'get_me': "get_me",
+}
+
 class UserbotManager:
     """Менеджер для управления userbot'ом одного менеджера"""
 
-    def __init__(self, manager_id: str, manager_name: str, api_id: int, api_hash: str, phone: str):
+    def __init__(self, manager_id: str, manager_name: str, api_id: int, api_hash: str, phone: str,
+                 session=None):
         self.manager_id = manager_id
         self.manager_name = manager_name
         self.api_id = api_id
         self.api_hash = api_hash
         self.phone = phone
 
-        # Путь к session файлу
-        session_file = DATA_DIR / f"{manager_id}.session"
+        # Путь к session файлу (другую сессию, например StringSession, можно передать явно)
+        session = session or str(DATA_DIR / f"{manager_id}.session")
 
-        # Создаем клиента
-        self.client = TelegramClient(str(session_file), api_id, api_hash)
+        # Создаем клиента (короткие FloodWait Telethon пережидает сам - в том числе при подключении
+        # и догрузке обновлений; длинные в запросах через request_scheduler обрабатывает планировщик)
+        self.client = TelegramClient(session, api_id, api_hash)
 
         # Анализатор сообщений
         self.analyzer = MessageAnalyzer(manager_id, manager_name)
@@ -30,71 +56,135 @@ class UserbotManager:
         # Статус
         self.is_running = False
         self.last_activity = None
+        self.activity = ActivityTracker()
+
+        # Последнее обновление списка диалогов (get_dialogs - только редко или по запросу, в фоне)
+        self.private_dialogs = None
+        self.dialogs_refreshed_at = None
+        self._dialogs_task: Optional[asyncio.Task] = None
+
+        # Аккаунт (заполняется после запуска) и длительность этапов запуска, секунд
+        self.username = None
+        self.startup_timings: dict[str, float] = {}
 
-    async def start(self):
-        """Запустить userbot"""
+    async def start(self) -> bool:
+        """Запустить userbot (подключение, обработчики, информация об аккаунте)"""
+        if not await self.connect():
+            return False
+        self.activate()
+        await self.identify()
+        return True
+
+    async def connect(self) -> bool:
+        """Подключиться и проверить авторизацию"""
         try:
             logger.info(f"🚀 Запуск userbot для {self.manager_name}...")
 
             # Подключаемся
+            started = time.perf_counter()
             await self.client.connect()
+            self.startup_timings['connect'] = time.perf_counter() - started
 
             # Проверяем авторизацию
-            if not await self.client.is_user_authorized():
+            started = time.perf_counter()
+            authorized = await self.client.is_user_authorized()
+            self.startup_timings['authorize'] = time.perf_counter() - started
+            if not authorized:
                 logger.warning(f"⚠️ {self.manager_name} не авторизован. Требуется код.")
                 # В production это будет обработано через add_manager.py
                 return False
 
-            # Получаем информацию о себе
-            me = await self.client.get_me()
-            logger.info(f"✅ {self.manager_name} подключен как @{me.username}")
-
-            # Регистрируем обработчики событий
-            self._register_handlers()
-
-            self.is_running = True
-            logger.info(f"✅ Userbot {self.manager_name} успешно запущен")
-
             return True
 
         except Exception as e:
             logger.error(f"❌ Ошибка запуска userbot {self.manager_name}: {e}")
             return False
 
-    def _register_handlers(self):
-        """Регистрация обработчиков событий Telegram"""
+    def activate(self):
+        """Зарегистрировать обработчики событий - с этого момента сообщения фиксируются"""
+        self._register_handlers()
+        self.is_running = True
+        logger.info(f"✅ Userbot {self.manager_name} успешно запущен")
 
-        @self.client.on(events.NewMessage(incoming=True, outgoing=False))
-        async def handle_incoming(event):
-            """Обработка входящих сообщений"""
-            # Игнорируем сообщения от ботов и каналов
-            if event.is_channel or event.is_group:
-                return
+    async def identify(self):
+        """Получить информацию о себе (не задерживает прием сообщений)"""
+        try:
+            # Запуск - вперед фоновых запросов аккаунта (догрузка истории, обновление диалогов)
+            started = time.perf_counter()
+            me = await request_scheduler.call(self.manager_id, self.client.get_me, priority=Priority.LIVE)
+            self.startup_timings['get_me'] = time.perf_counter() - started
+            self.username = me.username
+            logger.info(f"✅ {self.manager_name} подключен как @{me.username}")
+        except Exception as e:
+            logger.error(f"Ошибка получения аккаунта {self.manager_name}: {e}")
 
-            self.last_activity = asyncio.get_event_loop().time()
+    def _register_handlers(self):
+        """Регистрация обработчиков событий Telegram"""
+        self.client.add_event_handler(self._on_incoming, events.NewMessage(incoming=True, outgoing=False))
+        self.client.add_event_handler(self._on_outgoing, events.NewMessage(incoming=False, outgoing=True))
+
+    async def _on_incoming(self, event):
+        """Обработка входящих сообщений"""
+        # Игнорируем сообщения от ботов и каналов
+        if event.is_channel or event.is_group:
+            return
+
+        self.last_activity = asyncio.get_event_loop().time()
+        self.activity.record(event.chat_id, self.last_activity)
+        events_total.inc(self.manager_id, 'incoming')
+        with handler_seconds.time('incoming', self.manager_id):
             await self.analyzer.analyze_incoming_message(event)
 
-        @self.client.on(events.NewMessage(incoming=False, outgoing=True))
-        async def handle_outgoing(event):
-            """Обработка исходящих сообщений"""
-            # Только личные чаты
-            if event.is_channel or event.is_group:
-                return
+    async def _on_outgoing(self, event):
+        """Обработка исходящих сообщений"""
+        # Только личные чаты
+        if event.is_channel or event.is_group:
+            return
 
-            self.last_activity = asyncio.get_event_loop().time()
+        self.last_activity = asyncio.get_event_loop().time()
+        self.activity.record(event.chat_id, self.last_activity)
+        events_total.inc(self.manager_id, 'outgoing')
+        with handler_seconds.time('outgoing', self.manager_id):
             await self.analyzer.analyze_outgoing_message(event)
 
     async def stop(self):
         """Остановить userbot"""
         try:
             self.is_running = False
+            if self._dialogs_task is not None:
+                self._dialogs_task.cancel()
             await self.client.disconnect()
             logger.info(f"🛑 Userbot {self.manager_name} остановлен")
         except Exception as e:
             logger.error(f"Ошибка остановки userbot: {e}")
 
-    async def get_status(self) -> dict:
-        """Получить статус userbot"""
+    async def refresh_dialogs(self):
+        """Пересчитать личные диалоги через get_dialogs (тяжелый запрос, фоновый приоритет)"""
+        try:
+            dialogs = await request_scheduler.call(self.manager_id, self.client.get_dialogs, limit=100)
+            self.private_dialogs = len([d for d in dialogs if d.is_user and not d.entity.bot])
+        except Exception as e:
+            logger.error(f"Ошибка обновления диалогов {self.manager_name}: {e}")
+        finally:
+            # Время попытки, а не успеха: после ошибки повтор - не раньше следующего интервала
+            self.dialogs_refreshed_at = asyncio.get_event_loop().time()
+
+    def schedule_dialogs_refresh(self, force: bool = False):
+        """Запустить обновление диалогов в фоне, если оно устарело (не больше одного одновременно)"""
+        if self._dialogs_task is not None and not self._dialogs_task.done():
+            return
+
+        stale = (
+            DIALOGS_REFRESH_INTERVAL > 0 and (
+                self.dialogs_refreshed_at is None or
+                asyncio.get_event_loop().time() - self.dialogs_refreshed_at >= DIALOGS_REFRESH_INTERVAL
+            )
+        )
+        if force or stale:
+            self._dialogs_task = asyncio.create_task(self.refresh_dialogs())
+
+    async def get_status(self, refresh_dialogs: bool = False) -> dict:
+        """Получить статус userbot (из счетчиков событий, без запросов к Telegram)"""
         try:
             if not self.is_running:
                 return {
@@ -104,15 +194,17 @@ class UserbotManager:
                     'last_activity': self.last_activity
                 }
 
-            # Получаем количество активных диалогов
-            dialogs = await self.client.get_dialogs(limit=100)
-            private_chats = len([d for d in dialogs if d.is_user and not d.entity.bot])
+            # Список диалогов - только по запросу или раз в DIALOGS_REFRESH_INTERVAL; в статусе - последний известный
+            self.schedule_dialogs_refresh(force=refresh_dialogs)
 
             return {
                 'manager_id': self.manager_id,
                 'manager_name': self.manager_name,
                 'status': 'online',
-                'active_chats': private_chats,
+                'active_chats': self.activity.active_chats(),
+                'events_per_minute': self.activity.events_per_minute(),
+                'private_dialogs': self.private_dialogs,
+                'pending_responses': self.analyzer.pending_responses.get_stats(),
                 'last_activity': self.last_activity
             }
         except Exception as e:
@@ -130,25 +222,152 @@ class UserbotOrchestrator:
 
     def __init__(self):
         self.userbots: dict[str, UserbotManager] = {}
+        self.startup_timings: dict[str, float] = {}
 
     def add_userbot(self, manager_id: str, manager_name: str, api_id: int, api_hash: str, phone: str):
         """Добавить userbot"""
         userbot = UserbotManager(manager_id, manager_name, api_id, api_hash, phone)
         self.userbots[manager_id] = userbot
         logger.info(f"➕ Добавлен userbot для {manager_name}")
+        return userbot
+
+    async def remove_userbot(self, manager_id: str):
+        """Остановить и удалить userbot"""
+        userbot = self.userbots.pop(manager_id, None)
+        if userbot is not None:
+            await userbot.stop()
+            logger.info(f"➖ Удален userbot для {userbot.manager_name}")
+
+    async def reload(self, managers: list[dict]):
+        """Применить новый список менеджеров: запускаются только новые, останавливаются только удаленные"""
+        desired = {m['id']: m for m in managers}
+
+        removed = [mid for mid in self.userbots if mid not in desired]
+        changed = [
+            mid for mid, m in desired.items()
+            if mid in self.userbots and (
+                self.userbots[mid].manager_name, self.userbots[mid].api_id,
+                self.userbots[mid].api_hash, self.userbots[mid].phone
+            ) != (m['name'], m['api_id'], m['api_hash'], m['phone'])
+        ]
+        added = [mid for mid in desired if mid not in self.userbots]
+
+        if not (removed or changed or added):
+            return
+
+        logger.info(f"🔄 Перезагрузка менеджеров: +{len(added)} -{len(removed)} ~{len(changed)}")
+
+        await asyncio.gather(*(self.remove_userbot(mid) for mid in removed + changed), return_exceptions=True)
+
+        started = []
+        for mid in added + changed:
+            m = desired[mid]
+            userbot = self.add_userbot(mid, m['name'], m['api_id'], m['api_hash'], m['phone'])
+            started.append(userbot.start())
+
+        # Прогрев при старте охватывал только менеджеров шарда; у пересозданных - новый анализатор
+        if added or changed:
+            await self.warm_up(added + changed)
+
+        results = await asyncio.gather(*started, return_exceptions=True)
+        success_count = sum(1 for r in results if r is True)
+        logger.info(f"✅ Перезагрузка завершена, запущено: {success_count}/{len(started)}")
 
     async def start_all(self):
-        """Запустить все userbot'ы"""
+        """Запустить все userbot'ы: сессии подключаются параллельно, обработчики - сразу после авторизации"""
         logger.info(f"🚀 Запуск {len(self.userbots)} userbot'ов...")
+        started = time.perf_counter()
 
-        tasks = []
-        for userbot in self.userbots.values():
-            tasks.append(userbot.start())
+        # Фоновая пакетная запись переписок и часовой свертки
+        conversation_writer.start()
+        hourly_rollup.start()
+        local_store.start()
+
+        # Состояние из БД загружается одновременно с подключением сессий
+        state = asyncio.create_task(self._restore_state())
+        slots = asyncio.Semaphore(STARTUP_CONCURRENCY)
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        results = await asyncio.gather(
+            *(self._bring_up(userbot, state, slots, started) for userbot in self.userbots.values()),
+            return_exceptions=True
+        )
+        await state
+        attribution_engine.start()
 
         success_count = sum(1 for r in results if r is True)
-        logger.info(f"✅ Успешно запущено: {success_count}/{len(self.userbots)}")
+        logger.info(f"✅ Успешно запущено: {success_count}/{len(self.userbots)} "
+                    f"за {time.perf_counter() - started:.1f} с")
+        self._log_startup_timings()
+
+    async def _restore_state(self):
+        """Индекс клиентов, ожидания ответов и справочник каналов - до первых обработчиков"""
+        started = time.perf_counter()
+        # Восстанавливаем состояние в памяти до регистрации обработчиков
+        if not last_seen_index.is_warm:
+            # Снимок прошлой штатной остановки заменяет чтение окна NEW_CLIENT_HOURS из БД
+            if last_seen_index.load_snapshot(CLIENT_INDEX_DIR, list(self.userbots)):
+                await self.warm_up(hours=RESPONSE_PENDING_TTL_HOURS)
+            else:
+                await self.warm_up()
+        # Справочник каналов нужен уже для первых входящих
+        await attribution_engine.refresh()
+        self.startup_timings['state'] = time.perf_counter() - started
+
+    async def _bring_up(self, userbot: UserbotManager, state: asyncio.Task, slots: asyncio.Semaphore,
+                        started: float) -> bool:
+        """Этапы запуска одного userbot'а"""
+        # Подключение и авторизация - не больше STARTUP_CONCURRENCY сессий одновременно
+        async with slots:
+            if not await userbot.connect():
+                return False
+
+        # Обработчики - как только готово состояние (обычно оно загружается быстрее подключений)
+        await state
+        userbot.activate()
+        userbot.startup_timings['ready'] = time.perf_counter() - started
+
+        await userbot.identify()
+        return True
+
+    def _log_startup_timings(self):
+        """Сводка длительности этапов запуска (медиана / максимум по userbot'ам)"""
+        stages = {}
+        for userbot in self.userbots.values():
+            for stage, seconds in userbot.startup_timings.items():
+                stages.setdefault(stage, []).append(seconds)
+
+        parts = [f"состояние БД {self.startup_timings.get('state', 0):.2f} с"]
+        for stage, title in STARTUP_STAGES.items():
+            values = sorted(stages.get(stage, []))
+            if values:
+                parts.append(f"{title} {values[len(values) // 2]:.2f}/{values[-1]:.2f} с")
+        logger.info(f"⏱️ Этапы запуска (медиана/максимум): {', '.join(parts)}")
+
+    async def warm_up(self, manager_ids: Optional[list[str]] = None, hours: Optional[int] = None):
+        """Прогреть индекс клиентов, ожидания ответов и фильтр повторов одним запросом недавних сообщений"""
+        # Только свои менеджеры: шард не читает переписку всего парка
+        manager_ids = list(self.userbots) if manager_ids is None else manager_ids
+        # Без снимка индекса - окно, нужное и индексу, и ожиданиям ответа
+        hours = max(NEW_CLIENT_HOURS, RESPONSE_PENDING_TTL_HOURS) if hours is None else hours
+        try:
+            rows = await get_recent_activity(datetime.now() - timedelta(hours=hours), manager_ids)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки недавних сообщений: {e}")
+            return
+
+        last_seen_index.load(rows)
+        recent_messages.load(rows)
+
+        by_manager: dict[str, list[dict]] = {}
+        for row in rows:
+            by_manager.setdefault(row['manager_id'], []).append(row)
+
+        userbots = [self.userbots[mid] for mid in manager_ids if mid in self.userbots]
+        for userbot in userbots:
+            userbot.analyzer.pending_responses.restore(by_manager.get(userbot.manager_id, []))
+
+        restored = sum(len(u.analyzer.pending_responses) for u in userbots)
+        logger.info(f"⏳ Восстановлено ожиданий ответа: {restored}")
 
     async def stop_all(self):
         """Остановить все userbot'ы"""
@@ -159,13 +378,26 @@ class UserbotOrchestrator:
             tasks.append(userbot.stop())
 
         await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Дописываем всё, что осталось в буферах
+        await conversation_writer.stop()
+        await hourly_rollup.stop()
+        await local_store.stop()
+        await attribution_engine.stop()
+
+        # Снимок индекса клиентов - для быстрого следующего старта
+        try:
+            last_seen_index.save_snapshot(CLIENT_INDEX_DIR, list(self.userbots))
+        except Exception as e:
+            logger.error(f"Ошибка записи снимка индекса клиентов: {e}")
+
         logger.info("✅ Все userbot'ы остановлены")
 
-    async def get_all_statuses(self) -> list[dict]:
+    async def get_all_statuses(self, refresh_dialogs: bool = False) -> list[dict]:
         """Получить статус всех userbot'ов"""
         tasks = []
         for userbot in self.userbots.values():
-            tasks.append(userbot.get_status())
+            tasks.append(userbot.get_status(refresh_dialogs))
 
         statuses = await asyncio.gather(*tasks, return_exceptions=True)
         return [s for s in statuses if isinstance(s, dict)]
@@ -186,6 +418,18 @@ class UserbotOrchestrator:
                 online = sum(1 for s in statuses if s.get('status') == 'online')
                 logger.debug(f"💚 Онлайн: {online}/{len(statuses)}")
 
+                last_seen_index.prune()
+                for userbot in self.userbots.values():
+                    userbot.analyzer.pending_responses.evict_expired()
+
+                for account_id, stats in request_scheduler.get_stats().items():
+                    if stats['queued'] or stats['blocked_for']:
+                        logger.debug(f"⏳ [{account_id}] Запросы к Telegram: {stats}")
+
+                writer_stats = conversation_writer.get_stats()
+                logger.debug(f"💾 Буфер переписок: в очереди={writer_stats['queue_depth']}, "
+                             f"последний сброс={writer_stats['last_flush_latency']}")
+
         except KeyboardInterrupt:
             logger.info("⚠️ Получен сигнал остановки")
         finally:
@@ -15,6 +15,8 @@ CREATE TABLE IF NOT EXISTS telegram_conversations (
   channel_source TEXT,
   response_time_minutes NUMERIC(10, 2),
   message_text TEXT,
+  chat_id BIGINT,              -- чат Telegram, в котором пришло сообщение
+  telegram_message_id BIGINT,  -- ID сообщения в Telegram (ключ идемпотентной записи)
   created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
@@ -35,6 +37,8 @@ CREATE TABLE IF NOT EXISTS telegram_daily_stats (
   messages_sent INTEGER DEFAULT 0,
   messages_received INTEGER DEFAULT 0,
   avg_response_time_minutes NUMERIC(10, 2),
+  response_time_histogram JSONB,
+  is_closed BOOLEAN NOT NULL DEFAULT FALSE,  -- прошедший день посчитан окончательно
   created_at TIMESTAMPTZ DEFAULT NOW(),
   updated_at TIMESTAMPTZ DEFAULT NOW(),
   UNIQUE(manager_id, date)
@@ -59,7 +63,9 @@ CREATE TABLE IF NOT EXISTS telegram_manager_metrics (
   fastest_response_seconds INTEGER,
   slowest_response_minutes INTEGER,
   conversion_rate NUMERIC(5, 2),
-  created_at TIMESTAMPTZ DEFAULT NOW()
+  response_time_histogram JSONB,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  UNIQUE(manager_id, period_start, period_end)
 );
 
 -- Индексы
@@ -71,12 +77,38 @@ CREATE TABLE IF NOT EXISTS telegram_channel_sources (
   id BIGSERIAL PRIMARY KEY,
   channel_name TEXT NOT NULL UNIQUE,
   channel_username TEXT,
+  start_param TEXT,            -- параметр deep-link ссылки (?start=...)
+  channel_telegram_id BIGINT,  -- ID канала для пересланных постов
   total_clients INTEGER DEFAULT 0,
   conversion_rate NUMERIC(5, 2),
   created_at TIMESTAMPTZ DEFAULT NOW(),
   updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- 5. Часовая свертка (менеджер × час × канал), пишется процессом приема событий
+CREATE TABLE IF NOT EXISTS telegram_hourly_rollup (
+  id BIGSERIAL PRIMARY KEY,
+  manager_id TEXT NOT NULL,
+  hour TIMESTAMPTZ NOT NULL,
+  channel_source TEXT NOT NULL DEFAULT 'unknown',
+  messages_received INTEGER DEFAULT 0,
+  messages_sent INTEGER DEFAULT 0,
+  new_clients INTEGER DEFAULT 0,
+  response_time_sum NUMERIC(14, 2) DEFAULT 0,
+  response_time_count INTEGER DEFAULT 0,
+  client_sketch JSONB DEFAULT '{}'::jsonb,  -- разреженный HyperLogLog {регистр: ранг}
+  updated_at TIMESTAMPTZ DEFAULT NOW(),
+  UNIQUE(manager_id, hour, channel_source)
+);
+
+CREATE INDEX IF NOT EXISTS idx_hourly_rollup_hour ON telegram_hourly_rollup(hour, id);
+
+-- Примененные пачки приращений свертки (повтор пачки после таймаута не прибавляется второй раз)
+CREATE TABLE IF NOT EXISTS telegram_rollup_batches (
+  id TEXT PRIMARY KEY,
+  applied_at TIMESTAMPTZ DEFAULT NOW()
+);
+
 -- =====================================================
 -- VIEWS (представления для удобных запросов)
 -- =====================================================
@@ -91,7 +123,21 @@ SELECT
   SUM(CASE WHEN message_type = 'incoming' THEN 1 ELSE 0 END) as messages_received,
   AVG(response_time_minutes) as avg_response_time
 FROM telegram_conversations
-WHERE DATE(message_time) = CURRENT_DATE
+WHERE message_time >= CURRENT_DATE
+  AND message_time < CURRENT_DATE + INTERVAL '1 day'
+GROUP BY manager_id;
+
+-- То же по часовой свертке (несколько десятков строк вместо всех сообщений дня)
+CREATE OR REPLACE VIEW v_today_manager_rollup AS
+SELECT
+  manager_id,
+  SUM(new_clients) as new_clients,
+  SUM(messages_sent) as messages_sent,
+  SUM(messages_received) as messages_received,
+  SUM(response_time_sum) / NULLIF(SUM(response_time_count), 0) as avg_response_time
+FROM telegram_hourly_rollup
+WHERE hour >= CURRENT_DATE
+  AND hour < CURRENT_DATE + INTERVAL '1 day'
 GROUP BY manager_id;
 
 -- Топ каналов по количеству клиентов
@@ -125,6 +171,103 @@ BEFORE UPDATE ON telegram_daily_stats
 FOR EACH ROW
 EXECUTE FUNCTION update_updated_at_column();
 
+-- Слияние разреженных HyperLogLog-скетчей: максимум ранга по каждому регистру
+CREATE OR REPLACE FUNCTION hll_sparse_merge(a JSONB, b JSONB)
+RETURNS JSONB AS $$
+  SELECT COALESCE(jsonb_object_agg(key, rank), '{}'::jsonb)
+  FROM (
+    SELECT key, MAX(value::int) as rank
+    FROM (
+      SELECT * FROM jsonb_each_text(COALESCE(a, '{}'::jsonb))
+      UNION ALL
+      SELECT * FROM jsonb_each_text(COALESCE(b, '{}'::jsonb))
+    ) registers
+    GROUP BY key
+  ) merged;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Прибавить приращения часовой свертки (вызывается через RPC пачкой).
+-- Пачка с уже примененным batch_id пропускается: FALSE
+CREATE OR REPLACE FUNCTION merge_hourly_rollup(rows JSONB, batch_id TEXT)
+RETURNS boolean AS $$
+BEGIN
+  INSERT INTO telegram_rollup_batches (id) VALUES (batch_id) ON CONFLICT DO NOTHING;
+  IF NOT FOUND THEN
+    RETURN FALSE;
+  END IF;
+  -- Повторы приходят в пределах минут - неделя с запасом
+  DELETE FROM telegram_rollup_batches WHERE applied_at < NOW() - INTERVAL '7 days';
+
+  INSERT INTO telegram_hourly_rollup AS r (
+    manager_id, hour, channel_source, messages_received, messages_sent,
+    new_clients, response_time_sum, response_time_count, client_sketch
+  )
+  SELECT
+    manager_id, hour, channel_source, messages_received, messages_sent,
+    new_clients, response_time_sum, response_time_count, client_sketch
+  FROM jsonb_to_recordset(rows) AS x(
+    manager_id TEXT, hour TIMESTAMPTZ, channel_source TEXT, messages_received INTEGER,
+    messages_sent INTEGER, new_clients INTEGER, response_time_sum NUMERIC,
+    response_time_count INTEGER, client_sketch JSONB
+  )
+  ON CONFLICT (manager_id, hour, channel_source) DO UPDATE SET
+    messages_received = r.messages_received + EXCLUDED.messages_received,
+    messages_sent = r.messages_sent + EXCLUDED.messages_sent,
+    new_clients = r.new_clients + EXCLUDED.new_clients,
+    response_time_sum = r.response_time_sum + EXCLUDED.response_time_sum,
+    response_time_count = r.response_time_count + EXCLUDED.response_time_count,
+    client_sketch = hll_sparse_merge(r.client_sketch, EXCLUDED.client_sketch),
+    updated_at = NOW();
+  RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перестроить свертку за часы [since, until) по telegram_conversations
+-- (scripts/rebuild_rollup.py: после падения процесса теряются приращения с последней записи)
+CREATE OR REPLACE FUNCTION replace_hourly_rollup(rows JSONB, since TIMESTAMPTZ, until TIMESTAMPTZ)
+RETURNS void AS $$
+BEGIN
+  DELETE FROM telegram_hourly_rollup WHERE hour >= since AND hour < until;
+
+  INSERT INTO telegram_hourly_rollup (
+    manager_id, hour, channel_source, messages_received, messages_sent,
+    new_clients, response_time_sum, response_time_count, client_sketch
+  )
+  SELECT
+    manager_id, hour, channel_source, messages_received, messages_sent,
+    new_clients, response_time_sum, response_time_count, client_sketch
+  FROM jsonb_to_recordset(rows) AS x(
+    manager_id TEXT, hour TIMESTAMPTZ, channel_source TEXT, messages_received INTEGER,
+    messages_sent INTEGER, new_clients INTEGER, response_time_sum NUMERIC,
+    response_time_count INTEGER, client_sketch JSONB
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+-- =====================================================
+-- MIGRATIONS (для уже созданной БД)
+-- =====================================================
+
+-- Гистограммы времени ответа (сливаются в недельные/месячные перцентили)
+ALTER TABLE telegram_daily_stats ADD COLUMN IF NOT EXISTS response_time_histogram JSONB;
+ALTER TABLE telegram_manager_metrics ADD COLUMN IF NOT EXISTS response_time_histogram JSONB;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_manager_metrics_unique_period
+  ON telegram_manager_metrics(manager_id, period_start, period_end);
+
+-- Справочник каналов: deep-link параметр и ID канала для атрибуции
+ALTER TABLE telegram_channel_sources ADD COLUMN IF NOT EXISTS start_param TEXT;
+ALTER TABLE telegram_channel_sources ADD COLUMN IF NOT EXISTS channel_telegram_id BIGINT;
+
+-- Кэш закрытых дней статистики
+ALTER TABLE telegram_daily_stats ADD COLUMN IF NOT EXISTS is_closed BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Идемпотентная запись переписок по ID сообщения Telegram
+ALTER TABLE telegram_conversations ADD COLUMN IF NOT EXISTS chat_id BIGINT;
+ALTER TABLE telegram_conversations ADD COLUMN IF NOT EXISTS telegram_message_id BIGINT;
+-- Повторная отправка того же сообщения не создает дубликат (старые строки без ID не мешают: NULL не конфликтует)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_message
+  ON telegram_conversations(manager_id, chat_id, telegram_message_id);
+
 -- =====================================================
 -- RLS (Row Level Security) - опционально
 -- =====================================================
@@ -6,16 +6,24 @@ Telegram Analytics Userbot System
 
 import asyncio
 import logging
+import multiprocessing
+import os
+import queue
 import signal
 import sys
-from pathlib import Path
+import time
+
+from config.settings import LOG_DIR, ensure_dirs
+
+# Рабочие папки создаются при запуске (импорт настроек их не создает)
+ensure_dirs()
 
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('logs/main.log'),
+        logging.FileHandler(LOG_DIR / 'main.log'),
         logging.StreamHandler(sys.stdout)
     ]
 )
@@ -24,34 +32,30 @@ logger = logging.getLogger(__name__)
 
 from core.userbot_manager import UserbotOrchestrator
 from core.statistics import StatisticsCalculator
+from core.batch_writer import conversation_writer
+from config.metrics import registry
+from core.metrics import start_metrics_server, monitor_event_loop
 from config.supabase import test_connection
-from config.settings import STATS_UPDATE_INTERVAL
+from config.managers import load_managers_config, shard_of
+from config.settings import (
+    STATS_UPDATE_INTERVAL, STATS_RECONCILE_INTERVAL, MANAGERS_CONFIG, SHARD_COUNT,
+    SHARD_STATUS_INTERVAL, SHARD_STABLE_AFTER, CONFIG_RELOAD_INTERVAL,
+    METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+)
 
 # Глобальный оркестратор
 orchestrator = UserbotOrchestrator()
 
-async def load_managers():
-    """Загрузить список менеджеров из конфига"""
-    # TODO: В реальной версии загружать из файла managers/config.json
-    # Для примера добавляю вручную
-
+async def load_managers(shard_index: int = 0, shard_count: int = 1):
+    """Загрузить список менеджеров из конфига (только менеджеров своего шарда)"""
     logger.info("📋 Загрузка списка менеджеров...")
 
-    # Пример (в реальности будет из файла):
-    # orchestrator.add_userbot(
-    #     manager_id="ivan",
-    #     manager_name="Иван",
-    #     api_id=12345678,
-    #     api_hash="abc123...",
-    #     phone="+79991234567"
-    # )
-
     # Загружаем из managers/config.json
-    config_file = Path("managers/config.json")
-    if config_file.exists():
-        import json
-        with open(config_file, 'r') as f:
-            managers = json.load(f)
+    if MANAGERS_CONFIG.exists():
+        managers = [
+            m for m in load_managers_config()
+            if shard_of(m['id'], shard_count) == shard_index
+        ]
 
         for manager in managers:
             orchestrator.add_userbot(
@@ -67,27 +71,112 @@ async def load_managers():
         logger.warning("⚠️ Файл managers/config.json не найден")
         logger.info("ℹ️ Используйте `python scripts/add_manager.py` для добавления менеджеров")
 
+async def reconcile_daily_stats():
+    """Полный пересчет статистики за сегодня из БД (сверка счетчиков)"""
+    manager_ids = list(orchestrator.userbots.keys())
+    if manager_ids:
+        await StatisticsCalculator.calculate_all_daily_stats(manager_ids)
+
 async def periodic_stats_update():
     """Периодическое обновление статистики"""
+    loop = asyncio.get_running_loop()
+    last_reconcile = loop.time()
+
     while True:
         try:
             await asyncio.sleep(STATS_UPDATE_INTERVAL)
 
-            logger.info("📊 Обновление ежедневной статистики...")
+            if loop.time() - last_reconcile >= STATS_RECONCILE_INTERVAL:
+                logger.info("📊 Сверка ежедневной статистики с БД...")
+                await reconcile_daily_stats()
+                last_reconcile = loop.time()
+            else:
+                logger.info("📊 Обновление ежедневной статистики...")
+                saved = await StatisticsCalculator.persist_incremental_stats()
+                logger.info(f"✅ Статистика обновлена (изменившихся дней: {saved})")
 
-            # Получаем список всех менеджеров
-            for manager_id in orchestrator.userbots.keys():
-                await StatisticsCalculator.calculate_daily_stats(manager_id)
+        except Exception as e:
+            logger.error(f"Ошибка обновления статистики: {e}")
 
-            logger.info("✅ Статистика обновлена")
+async def watch_managers_config(shard_index: int = 0, shard_count: int = 1):
+    """Следить за managers/config.json (и SIGHUP) и применять изменения без рестарта"""
+    reload_requested = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_requested.set)
+
+    last_mtime = MANAGERS_CONFIG.stat().st_mtime if MANAGERS_CONFIG.exists() else None
+
+    while True:
+        try:
+            await asyncio.wait_for(reload_requested.wait(), timeout=CONFIG_RELOAD_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            mtime = MANAGERS_CONFIG.stat().st_mtime if MANAGERS_CONFIG.exists() else None
+            confirmed = reload_requested.is_set()
+            if mtime == last_mtime and not confirmed:
+                continue
+            reload_requested.clear()
+
+            all_managers = load_managers_config()
+            # Пустой конфиг (например, недописанный при редактировании) остановил бы всех:
+            # такое применяется только по явному SIGHUP
+            if not all_managers and not confirmed:
+                logger.warning("⚠️ В managers/config.json нет менеджеров - изменения не применены. "
+                               "Чтобы остановить всех, отправьте SIGHUP")
+                last_mtime = mtime
+                continue
+
+            managers = [
+                m for m in all_managers
+                if shard_of(m['id'], shard_count) == shard_index
+            ]
+            await orchestrator.reload(managers)
+            last_mtime = mtime
 
         except Exception as e:
-            logger.error(f"Ошибка обновления статистики: {e}")
+            # Например, файл записан не до конца - попробуем на следующей проверке
+            logger.error(f"Ошибка перезагрузки managers/config.json: {e}")
+
+async def start_metrics(shard_index: int = 0):
+    """Эндпоинт метрик шарда: состояние очередей снимается в момент запроса"""
+    registry.gauge(
+        'pending_responses', 'Клиенты, ожидающие ответа менеджера', ('manager_id',),
+        callback=lambda: {
+            (manager_id,): len(userbot.analyzer.pending_responses)
+            for manager_id, userbot in orchestrator.userbots.items()
+        }
+    )
+    registry.gauge(
+        'conversation_queue_depth', 'Строки переписки, ожидающие записи в БД',
+        callback=lambda: {(): conversation_writer.queue_depth}
+    )
+
+    try:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT + shard_index)
+    except OSError as e:
+        # Занятый порт не должен мешать приему сообщений
+        logger.error(f"❌ Не удалось запустить эндпоинт метрик: {e}")
+        return
+
+    asyncio.create_task(monitor_event_loop())
+
+async def report_shard_status(shard_index: int, status_queue):
+    """Периодически отправлять статусы userbot'ов шарда супервизору"""
+    while True:
+        await asyncio.sleep(SHARD_STATUS_INTERVAL)
+        try:
+            statuses = await orchestrator.get_all_statuses()
+            status_queue.put_nowait({'shard': shard_index, 'statuses': statuses})
+        except Exception as e:
+            logger.error(f"Ошибка отправки статуса шарда: {e}")
 
-async def main():
-    """Главная функция"""
+async def main(shard_index: int = 0, shard_count: int = 1, status_queue=None):
+    """Главная функция (весь парк или один шард)"""
     logger.info("=" * 60)
     logger.info("🤖 TELEGRAM ANALYTICS USERBOT SYSTEM")
+    if shard_count > 1:
+        logger.info(f"🧩 Шард {shard_index + 1}/{shard_count}")
     logger.info("=" * 60)
 
     # Проверяем подключение к Supabase
@@ -97,19 +186,143 @@ async def main():
         return
 
     # Загружаем менеджеров
-    await load_managers()
+    await load_managers(shard_index, shard_count)
 
     if not orchestrator.userbots:
-        logger.error("❌ Нет менеджеров для запуска")
+        # Не выходим: менеджеры подхватятся из managers/config.json без рестарта
+        logger.warning("⚠️ Нет менеджеров для запуска, ждем изменений managers/config.json")
         logger.info("ℹ️ Добавьте менеджеров через: python scripts/add_manager.py")
-        return
+
+    if METRICS_ENABLED:
+        await start_metrics(shard_index)
+
+    # Засеваем инкрементальные счетчики полным пересчетом сегодняшнего дня
+    await reconcile_daily_stats()
 
     # Запускаем периодическое обновление статистики
     asyncio.create_task(periodic_stats_update())
 
+    # Подхватываем изменения managers/config.json на лету
+    asyncio.create_task(watch_managers_config(shard_index, shard_count))
+
+    # Статусы для супервизора
+    if status_queue is not None:
+        asyncio.create_task(report_shard_status(shard_index, status_queue))
+
     # Запускаем все userbot'ы
     await orchestrator.run_forever()
 
+async def shard_main(shard_index: int, shard_count: int, status_queue):
+    """Шард: SIGTERM/SIGINT отменяют главную задачу, чтобы stop_all дописал буферы"""
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    stopping = False
+
+    def request_stop():
+        # Повторный сигнал не должен прерывать уже идущую остановку
+        nonlocal stopping
+        if not stopping:
+            stopping = True
+            task.cancel()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, request_stop)
+
+    try:
+        await main(shard_index, shard_count, status_queue)
+    except asyncio.CancelledError:
+        logger.info(f"👋 Шард {shard_index} остановлен")
+
+def run_shard(shard_index: int, shard_count: int, status_queue):
+    """Точка входа процесса-шарда"""
+    try:
+        asyncio.run(shard_main(shard_index, shard_count, status_queue))
+    except Exception as e:
+        logger.error(f"❌ Критическая ошибка шарда {shard_index}: {e}", exc_info=True)
+        sys.exit(1)
+
+def supervise_shards(shard_count: int):
+    """Супервизор: запускает шарды, перезапускает упавшие и сводит их статусы"""
+    ctx = multiprocessing.get_context('spawn')
+    status_queue = ctx.Queue()
+    shards = {}
+    statuses = {}
+
+    def start_shard(shard_index: int):
+        # Номер шарда дочерний процесс читает из окружения (config.settings.SHARD_INDEX)
+        os.environ['SHARD_INDEX'] = str(shard_index)
+        process = ctx.Process(
+            target=run_shard, args=(shard_index, shard_count, status_queue), name=f"shard-{shard_index}"
+        )
+        process.start()
+
+        shard = shards.setdefault(shard_index, {'restarts': 0})
+        shard.update(process=process, started=time.monotonic(), restart_at=None)
+        logger.info(f"🧩 Шард {shard_index} запущен (pid {process.pid})")
+
+    def forward_reload(sig, frame):
+        # SIGHUP супервизору - перечитать конфиг во всех шардах
+        for shard in shards.values():
+            if shard['process'].is_alive():
+                os.kill(shard['process'].pid, signal.SIGHUP)
+
+    signal.signal(signal.SIGHUP, forward_reload)
+
+    logger.info(f"🧩 Запуск {shard_count} шардов...")
+    for shard_index in range(shard_count):
+        start_shard(shard_index)
+
+    last_report = time.monotonic()
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+
+            # Забираем статусы шардов
+            while True:
+                try:
+                    message = status_queue.get_nowait()
+                except queue.Empty:
+                    break
+                statuses[message['shard']] = message['statuses']
+
+            # Перезапускаем упавшие шарды с нарастающей задержкой
+            for shard_index, shard in shards.items():
+                process = shard['process']
+                if process.is_alive():
+                    continue
+
+                if shard['restart_at'] is None:
+                    if now - shard['started'] > SHARD_STABLE_AFTER:
+                        shard['restarts'] = 0
+                    delay = min(2 ** shard['restarts'], 60)
+                    shard['restart_at'] = now + delay
+                    statuses.pop(shard_index, None)
+                    logger.error(f"💥 Шард {shard_index} завершился (код {process.exitcode}), "
+                                 f"перезапуск через {delay} с")
+                elif now >= shard['restart_at']:
+                    shard['restarts'] += 1
+                    start_shard(shard_index)
+
+            # Сводный статус
+            if now - last_report >= SHARD_STATUS_INTERVAL:
+                last_report = now
+                alive = sum(1 for s in shards.values() if s['process'].is_alive())
+                all_statuses = [s for shard_statuses in statuses.values() for s in shard_statuses]
+                online = sum(1 for s in all_statuses if s.get('status') == 'online')
+                events = sum(s.get('events_per_minute', 0) for s in all_statuses)
+                logger.info(f"🧩 Шардов: {alive}/{shard_count}, онлайн: {online}/{len(all_statuses)}, "
+                            f"событий/мин: {events}")
+    finally:
+        logger.info("🛑 Остановка шардов...")
+        for shard in shards.values():
+            if shard['process'].is_alive():
+                shard['process'].terminate()
+        for shard in shards.values():
+            shard['process'].join(timeout=30)
+            if shard['process'].is_alive():
+                shard['process'].kill()
+
 def signal_handler(sig, frame):
     """Обработчик сигналов для graceful shutdown"""
     logger.info("⚠️ Получен сигнал остановки")
@@ -121,7 +334,10 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, signal_handler)
 
     try:
-        asyncio.run(main())
+        if SHARD_COUNT > 1:
+            supervise_shards(SHARD_COUNT)
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("👋 Завершение работы...")
     except Exception as e:
@@ -13,7 +13,7 @@ from telethon.errors import SessionPasswordNeededError
 # Добавляем корневую папку в путь
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from config.settings import DATA_DIR
+from config.settings import DATA_DIR, ensure_dirs
 
 async def add_manager():
     """Интерактивное добавление менеджера"""
@@ -51,6 +51,7 @@ async def add_manager():
     print()
     print("🔐 Авторизация в Telegram...")
 
+    ensure_dirs()
     session_file = DATA_DIR / f"{manager_id}.session"
     client = TelegramClient(str(session_file), int(api_id), api_hash)
 
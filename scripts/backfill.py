@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Догрузка истории переписок за интервал времени
+(после добавления менеджера или простоя системы).
+
+Запускать при остановленном main.py: session файлы используются монопольно.
+Прерванную догрузку можно перезапустить с теми же параметрами (в том числе
+с --hours): для каждого диалога хранится уже загруженный интервал, и
+догружается только то, что в него не вошло.
+
+Примеры:
+    python scripts/backfill.py --hours 6
+    python scripts/backfill.py --manager ivan --since 2024-05-01 --until 2024-05-03
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.userbot_manager import UserbotOrchestrator
+from core.backfill import HistoryBackfill
+from core.attribution import attribution_engine
+from core.statistics import StatisticsCalculator
+from config.managers import load_managers_config
+from config.settings import MANAGERS_CONFIG
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Догрузка истории переписок")
+    parser.add_argument('--manager', help="ID менеджера (по умолчанию - все)")
+    parser.add_argument('--hours', type=int, help="Догрузить последние N часов")
+    parser.add_argument('--since', type=datetime.fromisoformat, help="Начало интервала (ISO)")
+    parser.add_argument('--until', type=datetime.fromisoformat, help="Конец интервала (ISO, по умолчанию - сейчас)")
+    args = parser.parse_args()
+
+    if not args.hours and not args.since:
+        parser.error("Укажите --hours или --since")
+    return args
+
+async def backfill():
+    """Догрузить историю и пересчитать статистику затронутых дней"""
+    args = parse_args()
+
+    end = args.until or datetime.now()
+    start = args.since or end - timedelta(hours=args.hours)
+
+    if not MANAGERS_CONFIG.exists():
+        print(f"❌ Файл {MANAGERS_CONFIG} не найден")
+        return
+
+    managers = load_managers_config()
+
+    if args.manager:
+        managers = [m for m in managers if m['id'] == args.manager]
+        if not managers:
+            print(f"❌ Менеджер '{args.manager}' не найден")
+            return
+
+    orchestrator = UserbotOrchestrator()
+    for manager in managers:
+        orchestrator.add_userbot(
+            manager_id=manager['id'],
+            manager_name=manager['name'],
+            api_id=manager['api_id'],
+            api_hash=manager['api_hash'],
+            phone=manager['phone']
+        )
+
+    # Подключаемся без регистрации обработчиков
+    userbots = []
+    for userbot in orchestrator.userbots.values():
+        await userbot.client.connect()
+        if await userbot.client.is_user_authorized():
+            userbots.append(userbot)
+        else:
+            print(f"⚠️ {userbot.manager_name} не авторизован - пропускаем")
+
+    print(f"⏪ Догрузка {start} - {end} для {len(userbots)} менеджеров...")
+
+    # Атрибуция по тому же справочнику каналов, что и у живого приема
+    await attribution_engine.refresh()
+
+    try:
+        stats = await HistoryBackfill(userbots, start, end).run()
+    finally:
+        for userbot in orchestrator.userbots.values():
+            await userbot.client.disconnect()
+
+    print(f"✅ Загружено сообщений: {stats['rows_loaded']} "
+          f"(диалогов: {stats['dialogs_done']}, пропущено: {stats['dialogs_skipped']})")
+
+    # Пересчитываем дневную статистику затронутых дней
+    manager_ids = [u.manager_id for u in userbots]
+    day = start.date()
+    while day <= end.date():
+        await StatisticsCalculator.calculate_all_daily_stats(manager_ids, day)
+        day += timedelta(days=1)
+
+    print("📊 Статистика пересчитана")
+
+if __name__ == "__main__":
+    asyncio.run(backfill())
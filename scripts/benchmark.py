@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест приема сообщений без Telegram и без живой БД.
+
+Синтетические события NewMessage подаются в обработчики UserbotManager
+(а через них - в MessageAnalyzer) с заданной частотой для нескольких
+менеджеров. Запросы к Supabase уходят в локальную заглушку PostgREST
+с настраиваемой задержкой. В конце - сообщений в секунду, p50/p99
+времени обработчика и число запросов к БД на сообщение.
+
+Примеры:
+    python scripts/benchmark.py --managers 20 --messages 50000
+    python scripts/benchmark.py --rate 500 --db-latency 40 --cold
+    python scripts/benchmark.py --json > before.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест приема сообщений")
+    parser.add_argument('--managers', type=int, default=10, help="Число менеджеров")
+    parser.add_argument('--clients', type=int, default=1000, help="Клиентов на менеджера")
+    parser.add_argument('--messages', type=int, default=20000, help="Всего входящих сообщений")
+    parser.add_argument('--reply-ratio', type=float, default=0.8, help="Доля входящих, на которые отвечает менеджер")
+    parser.add_argument('--rate', type=float, default=0, help="Событий в секунду (0 - без ограничения)")
+    parser.add_argument('--concurrency', type=int, default=1000, help="Максимум одновременно обрабатываемых событий")
+    parser.add_argument('--db-latency', type=float, default=20, help="Задержка ответа заглушки БД, мс")
+    parser.add_argument('--db-jitter', type=float, default=5, help="Случайная добавка к задержке, мс")
+    parser.add_argument('--cold', action='store_true', help="Не прогревать индекс клиентов (новые клиенты - через БД)")
+    parser.add_argument('--spool', action='store_true', help="Писать через SQLite-спул, как в production")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help="Вывести результат в JSON")
+    return parser.parse_args()
+
+
+class FakePostgREST:
+    """Заглушка HTTP API PostgREST в отдельном потоке: считает запросы и строки, отвечает с задержкой"""
+
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.requests = Counter()
+        self.rows = Counter()
+        self.url = None
+        self._loop = None
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="fake-postgrest", daemon=True).start()
+        self._ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self):
+        from aiohttp import web
+
+        async def handle(request):
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+            path = request.match_info['path']
+            self.requests[f"{request.method} {path}"] += 1
+
+            if request.method in ('POST', 'PATCH'):
+                body = await request.json()
+                rows = body if isinstance(body, list) else [body]
+                self.rows[path] += len(rows)
+                payload = True if path.startswith('rpc/') else rows
+            else:
+                payload = []
+
+            return web.json_response(payload, headers={'Content-Range': '*/0'})
+
+        async def serve():
+            app = web.Application(client_max_size=64 * 1024 * 1024)
+            app.router.add_route('*', '/rest/v1/{path:.*}', handle)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            host, port = runner.addresses[0][:2]
+            self.url = f"http://{host}:{port}"
+            self._ready.set()
+
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(serve())
+        self._loop.run_forever()
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, text, out: bool):
+        self.id = message_id
+        self.text = text
+        self.out = out
+        self.fwd_from = None
+
+
+class FakeEvent:
+    """Минимальный NewMessage.Event для обработчиков userbot'а"""
+
+    is_private = True
+    is_channel = False
+    is_group = False
+
+    def __init__(self, message_id: int, client_id: int, text, out: bool):
+        self.sender_id = client_id
+        self.chat_id = client_id
+        self.out = out
+        self.message = FakeMessage(message_id, text, out)
+
+
+def build_workload(args) -> list[tuple[int, FakeEvent]]:
+    """Последовательность (номер менеджера, событие): входящее и, возможно, ответ на него"""
+    rnd = random.Random(args.seed)
+    channels = [f"@channel_{i}" for i in range(20)]
+    workload = []
+
+    for _ in range(args.messages):
+        manager = rnd.randrange(args.managers)
+        client_id = 10_000_000 + manager * args.clients + rnd.randrange(args.clients)
+        text = f"Здравствуйте! Пишу из {rnd.choice(channels)}" if rnd.random() < 0.3 else "Сколько стоит?"
+
+        workload.append((manager, FakeEvent(len(workload) + 1, client_id, text, out=False)))
+        if rnd.random() < args.reply_ratio:
+            workload.append((manager, FakeEvent(len(workload) + 1, client_id, "Добрый день, сейчас расскажу", out=True)))
+
+    return workload
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_benchmark(args, db: FakePostgREST) -> dict:
+    # Импорт после настройки окружения: config.settings читает его при импорте
+    from telethon.sessions import StringSession
+    from core.userbot_manager import UserbotManager
+    from core.batch_writer import conversation_writer
+    from core.client_index import last_seen_index
+    from core.rollup import hourly_rollup
+    from core.attribution import attribution_engine
+
+    userbots = [
+        UserbotManager(f"bench_{i}", f"Bench {i}", 1, "0" * 32, "", session=StringSession())
+        for i in range(args.managers)
+    ]
+    workload = build_workload(args)
+
+    conversation_writer.start()
+    hourly_rollup.start()
+    await attribution_engine.refresh()
+    if not args.cold:
+        last_seen_index.load([])
+
+    warmup_requests = Counter(db.requests)
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def dispatch(userbot, event):
+        try:
+            handler = userbot._on_outgoing if event.out else userbot._on_incoming
+            started = time.perf_counter()
+            await handler(event)
+            latencies.append(time.perf_counter() - started)
+        finally:
+            semaphore.release()
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    started = loop.time()
+    for i, (manager, event) in enumerate(workload):
+        if args.rate:
+            delay = started + i / args.rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(dispatch(userbots[manager], event)))
+
+    await asyncio.gather(*tasks)
+    handled = loop.time() - started
+
+    # Дописываем очередь и свертку - запросы записи тоже относятся к нагрузке
+    await conversation_writer.stop()
+    await hourly_rollup.stop()
+    drained = loop.time() - started
+
+    by_route = db.requests - warmup_requests
+    requests = sum(by_route.values())
+    return {
+        'managers': args.managers,
+        'events': len(workload),
+        'handled_seconds': round(handled, 3),
+        'drained_seconds': round(drained, 3),
+        'events_per_second': round(len(workload) / handled, 1) if handled else 0.0,
+        'handler_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'handler_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'handler_max_ms': round(max(latencies, default=0) * 1000, 3),
+        'db_requests': requests,
+        'db_requests_per_event': round(requests / len(workload), 4) if workload else 0.0,
+        'db_requests_by_route': dict(by_route.most_common()),
+        'db_rows': dict(db.rows),
+    }
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    db = FakePostgREST(args.db_latency, args.db_jitter)
+    db.start()
+
+    # Все запросы - в заглушку, спул - во временный каталог (удаляется после прогона)
+    with tempfile.TemporaryDirectory(prefix="bench_spool_") as spool_dir:
+        os.environ.update({
+            'SUPABASE_URL': db.url,
+            'SUPABASE_KEY': "bench.bench.bench",
+            'SPOOL_ENABLED': "true" if args.spool else "false",
+            'SPOOL_PATH': str(Path(spool_dir) / "conversations.db"),
+        })
+
+        try:
+            result = asyncio.run(run_benchmark(args, db))
+        finally:
+            db.stop()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    print()
+    print(f"📊 Событий: {result['events']} ({result['managers']} менеджеров)")
+    print(f"⚡ Пропускная способность: {result['events_per_second']} событий/с "
+          f"(обработка {result['handled_seconds']} с, с дозаписью {result['drained_seconds']} с)")
+    print(f"⏱️ Обработчик: p50 {result['handler_p50_ms']} мс, p99 {result['handler_p99_ms']} мс, "
+          f"max {result['handler_max_ms']} мс")
+    print(f"🗄️ Запросов к БД: {result['db_requests']} ({result['db_requests_per_event']} на событие)")
+    for route, count in result['db_requests_by_route'].items():
+        print(f"   {route}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Отчеты по локальному аналитическому зеркалу (backups/analytics).
+
+sync   - загрузить дни из Supabase в зеркало (первичная загрузка или сверка;
+         данные этих дней в зеркале заменяются целиком; сегодняшний день
+         лучше загружать при остановленном main.py)
+report - агрегаты за интервал в разрезе измерений, без запросов к Supabase
+
+Примеры:
+    python scripts/local_report.py sync --since 2024-04-01 --until 2024-05-01
+    python scripts/local_report.py report --since 2024-04-01 --by manager_id,month
+    python scripts/local_report.py report --since 2024-04-01 --by weekday,hour_of_day --manager ivan
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from tabulate import tabulate
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.supabase import stream_rows
+from core.local_store import local_store, DIMENSIONS
+
+SYNC_COLUMNS = (
+    'manager_id, manager_name, client_telegram_id, message_time, message_type, '
+    'is_new_client, channel_source, response_time_minutes'
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Отчеты по локальному аналитическому зеркалу")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sync = subparsers.add_parser('sync', help="Загрузить дни из Supabase в зеркало")
+    report = subparsers.add_parser('report', help="Агрегаты по зеркалу")
+    for sub in (sync, report):
+        sub.add_argument('--since', type=datetime.fromisoformat, required=True, help="Начало интервала (ISO)")
+        sub.add_argument('--until', type=datetime.fromisoformat, help="Конец интервала (ISO, по умолчанию - сейчас)")
+
+    report.add_argument('--by', default='manager_id',
+                        help=f"Измерения через запятую: {', '.join(DIMENSIONS)}")
+    report.add_argument('--manager', action='append', help="ID менеджера (можно несколько раз)")
+    report.add_argument('--channel', action='append', help="Канал-источник (можно несколько раз)")
+    return parser.parse_args()
+
+async def sync(since: datetime, until: datetime):
+    """Перезаписать дни интервала данными из Supabase"""
+    day = since.date()
+    while day <= until.date():
+        start = datetime.combine(day, datetime.min.time())
+        end = start + timedelta(days=1)
+
+        rows = [
+            row async for row in stream_rows(
+                'telegram_conversations', SYNC_COLUMNS,
+                lambda q: q.gte('message_time', start.isoformat()).lt('message_time', end.isoformat()),
+                label='local_report_sync'
+            )
+        ]
+        await local_store.replace_day(day, rows)
+        print(f"📥 {day}: {len(rows)} сообщений")
+
+        day += timedelta(days=1)
+
+async def report(args):
+    """Вывести агрегаты таблицей"""
+    group_by = tuple(d.strip() for d in args.by.split(',') if d.strip())
+    rows = await local_store.aggregate(
+        args.since, args.until, group_by,
+        manager_ids=args.manager, channel_sources=args.channel
+    )
+
+    if not rows:
+        print("ℹ️ Нет данных за интервал (загрузите их: python scripts/local_report.py sync ...)")
+        return
+
+    print(tabulate(
+        [[round(v, 1) if isinstance(v, float) else v for v in row.values()] for row in rows],
+        headers=list(rows[0].keys()),
+        tablefmt='rounded_grid'
+    ))
+
+async def main():
+    args = parse_args()
+    args.until = args.until or datetime.now()
+
+    if args.command == 'sync':
+        await sync(args.since, args.until)
+    else:
+        await report(args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Замер памяти на состояние клиентов: словарь против ClientStateTable.
+
+Оба варианта заполняются одинаковыми синтетическими данными
+(менеджеры × клиенты -> время последнего сообщения), память считается
+через tracemalloc. Для таблицы дополнительно - размер снимка на диске
+и скорость поиска после открытия снимка через mmap.
+
+Примеры:
+    python scripts/measure_memory.py
+    python scripts/measure_memory.py --managers 25 --clients 200000
+"""
+
+import argparse
+import gc
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.client_store import ClientStateTable
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Замер памяти на состояние клиентов")
+    parser.add_argument('--managers', type=int, default=20, help="Число менеджеров")
+    parser.add_argument('--clients', type=int, default=50000, help="Клиентов на менеджера")
+    parser.add_argument('--lookups', type=int, default=200000, help="Поисков для замера скорости")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def build_workload(args) -> list[tuple[str, int, datetime]]:
+    """Синтетические (manager_id, client_id, время последнего сообщения)"""
+    rng = random.Random(args.seed)
+    now = datetime.now().replace(microsecond=0)
+    return [
+        (f"manager_{m}", rng.randrange(10 ** 8, 8 * 10 ** 9), now - timedelta(seconds=rng.randrange(30 * 86400)))
+        for m in range(args.managers)
+        for _ in range(args.clients)
+    ]
+
+
+def measure(build) -> tuple[object, int]:
+    """Построить структуру и вернуть ее вместе с занятой памятью"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def build_dict(workload) -> dict:
+    last_seen = {}
+    for manager_id, client_id, seen in workload:
+        last_seen[(manager_id, client_id)] = seen
+    return last_seen
+
+
+def build_tables(workload) -> dict[str, ClientStateTable]:
+    tables = {}
+    for manager_id, client_id, seen in workload:
+        table = tables.get(manager_id)
+        if table is None:
+            table = tables[manager_id] = ClientStateTable({'last_seen': 'I'})
+        table.set(client_id, 'last_seen', int(seen.timestamp()))
+    return tables
+
+
+def lookup_rate(get, keys) -> float:
+    """Поисков в секунду"""
+    started = time.perf_counter()
+    for manager_id, client_id in keys:
+        get(manager_id, client_id)
+    return len(keys) / (time.perf_counter() - started)
+
+
+def main():
+    args = parse_args()
+    # Данные создаются до замера: в память структур попадают только они сами
+    workload = build_workload(args)
+    entries = len({(m, c) for m, c, _ in workload})
+
+    dict_index, dict_bytes = measure(lambda: build_dict(workload))
+    # ID и datetime созданы заранее; в рабочем процессе их держит только словарь
+    dict_bytes += sum(sys.getsizeof(c) + sys.getsizeof(seen) for (_, c), seen in dict_index.items())
+
+    tables, table_bytes = measure(lambda: build_tables(workload))
+
+    rng = random.Random(args.seed + 1)
+    keys = [(m, c) for m, c, _ in rng.choices(workload, k=args.lookups)]
+    dict_rate = lookup_rate(lambda m, c: dict_index.get((m, c)), keys)
+    table_rate = lookup_rate(lambda m, c: tables[m].get(c, 'last_seen'), keys)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        for manager_id, table in tables.items():
+            table.save(Path(tmp) / f"{manager_id}.cst")
+        save_seconds = time.perf_counter() - started
+        snapshot_bytes = sum(p.stat().st_size for p in Path(tmp).glob("*.cst"))
+
+        started = time.perf_counter()
+        mapped = {p.stem: ClientStateTable.load(p, use_mmap=True) for p in Path(tmp).glob("*.cst")}
+        open_seconds = time.perf_counter() - started
+        mmap_rate = lookup_rate(lambda m, c: mapped[m].get(c, 'last_seen'), keys)
+
+        mismatches = sum(
+            1 for m, c in keys[:10000]
+            if mapped[m].get(c, 'last_seen') != tables[m].get(c, 'last_seen')
+        )
+        del mapped
+
+    print(f"Переписок: {entries:,} ({args.managers} менеджеров × {args.clients:,} клиентов)")
+    print(f"dict[(manager, client)] -> datetime: {dict_bytes / 2 ** 20:8.1f} МБ, "
+          f"{dict_bytes / entries:6.1f} байт/запись, {dict_rate:,.0f} поисков/с")
+    print(f"ClientStateTable (uint32):           {table_bytes / 2 ** 20:8.1f} МБ, "
+          f"{table_bytes / entries:6.1f} байт/запись, {table_rate:,.0f} поисков/с")
+    print(f"Экономия памяти: в {dict_bytes / table_bytes:.1f} раза")
+    print(f"Снимок: {snapshot_bytes / 2 ** 20:.1f} МБ, запись {save_seconds:.2f} с, "
+          f"открытие через mmap {open_seconds * 1000:.1f} мс, {mmap_rate:,.0f} поисков/с"
+          f"{'' if not mismatches else f', РАСХОЖДЕНИЙ: {mismatches}'}")
+
+
+if __name__ == "__main__":
+    main()
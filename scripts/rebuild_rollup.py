@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Перестроить часовую свертку (telegram_hourly_rollup) по telegram_conversations.
+
+Приращения свертки копятся в памяти и пишутся раз в ROLLUP_FLUSH_INTERVAL:
+если процесс упал (kill -9, OOM), часы вокруг падения недосчитаны. Скрипт
+пересчитывает строки свертки за интервал и заменяет их целиком. Текущий
+час не трогается - его еще пополняют работающие процессы.
+
+Запускать только при остановленном main.py (всех шардах) и не одновременно
+со scripts/backfill.py: работающий процесс держит в памяти приращения за эти
+часы и после замены допишет их поверх пересчитанных строк - часы будут
+посчитаны дважды. Поэтому скрипт требует явного подтверждения --stopped.
+
+Примеры:
+    python scripts/rebuild_rollup.py --hours 3 --stopped
+    python scripts/rebuild_rollup.py --since 2024-05-01T10:00 --until 2024-05-01T14:00 --stopped
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.rollup import rebuild
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Перестроить часовую свертку по переписке")
+    parser.add_argument('--hours', type=int, help="Последние N часов")
+    parser.add_argument('--since', type=datetime.fromisoformat, help="Начало интервала (ISO)")
+    parser.add_argument('--until', type=datetime.fromisoformat, help="Конец интервала (ISO, по умолчанию - сейчас)")
+    parser.add_argument('--stopped', action='store_true',
+                        help="Подтвердить, что main.py и scripts/backfill.py остановлены")
+    args = parser.parse_args()
+
+    if args.hours is None and args.since is None:
+        parser.error("Укажите --hours или --since")
+    if not args.stopped:
+        parser.error("Остановите main.py и scripts/backfill.py и подтвердите это флагом --stopped: "
+                     "незаписанные приращения работающего процесса легли бы поверх пересчета")
+    return args
+
+
+async def main():
+    args = parse_args()
+    until = args.until or datetime.now()
+    since = args.since or until - timedelta(hours=args.hours)
+
+    rows = await rebuild(since, until)
+    print(f"✅ Свертка перестроена: {rows} строк")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -9,7 +9,7 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from config.supabase import supabase, test_connection
+from config.supabase import get_client, test_connection
 
 async def main():
     """Тестирование подключения"""
@@ -27,7 +27,7 @@ async def main():
 
         for table in tables:
             try:
-                result = supabase.table(table).select("count", count='exact').limit(1).execute()
+                result = get_client().table(table).select("count", count='exact').limit(1).execute()
                 print(f"   ✅ {table}: OK (записей: {result.count})")
             except Exception as e:
                 print(f"   ❌ {table}: ОШИБКА - {e}")